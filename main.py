@@ -3,13 +3,42 @@ import sys
 import os
 import json
 import time
-from datetime import datetime
+import math
+import random
+import asyncio
+import sqlite3
+import threading
+import hashlib
+import re
+import zlib
+import uuid
+import contextvars
+import email.utils
+from collections import OrderedDict, deque
+from contextlib import contextmanager
+from datetime import date, datetime, timezone
 import logging
-import requests
+import httpx
 import pandas as pd
-from typing import List, Dict, Optional
+import pyarrow as pa
+import pyarrow.compute as pc
+from typing import List, Dict, Iterator, Optional
 from google.cloud import bigquery
 from google.oauth2 import service_account
+import google.auth.transport.requests
+try:
+    from google.cloud import bigquery_storage
+except ImportError:  # Storage Read API fast path is optional
+    bigquery_storage = None
+try:
+    import zstandard
+except ImportError:  # zstd webhook compression is optional
+    zstandard = None
+from streamlit.runtime.scriptrunner import add_script_run_ctx, get_script_run_ctx
+try:
+    from streamlit.runtime.scriptrunner_utils.script_run_context import SCRIPT_RUN_CONTEXT_ATTR_NAME
+except ImportError:  # Streamlit < 1.37
+    from streamlit.runtime.scriptrunner.script_run_context import SCRIPT_RUN_CONTEXT_ATTR_NAME
 
 # Configure page
 st.set_page_config(
@@ -72,7 +101,9 @@ st.markdown("""
 """, unsafe_allow_html=True)
 
 # Webhook endpoint for sending posts
-WEBHOOK_ENDPOINT = "https://anasalaa.app.n8n.cloud/webhook/6443b1e8-366d-4065-b2e0-73dceab9b820"
+WEBHOOK_ENDPOINT = os.environ.get(
+    "WEBHOOK_ENDPOINT", "https://anasalaa.app.n8n.cloud/webhook/6443b1e8-366d-4065-b2e0-73dceab9b820"
+)
 
 # Post template for flash sale cars
 POST_TEMPLATE = """🚗 {make} {model} - {year} - {kilometers:,} كم
@@ -80,11 +111,1144 @@ POST_TEMPLATE = """🚗 {make} {model} - {year} - {kilometers:,} كم
 📋 التقرير المفصل متوفر على التطبيق.
 📲 شوفها هنا: {tracking_link}"""
 
+# Tracking link API (nonito.xyz)
+TRACKING_LINK_ENDPOINT = os.environ.get("TRACKING_LINK_ENDPOINT", "https://hi.nonito.xyz/create_tracking_link")
+TRACKING_LINK_BULK_ENDPOINT = os.environ.get(
+    "TRACKING_LINK_BULK_ENDPOINT", "https://hi.nonito.xyz/create_tracking_links"
+)
+TRACKING_LINK_SENDER_ID = "6eb7c941-13b9-4eb3-8402-5310e2bc0f8e"
+TRACKING_LINK_DOMAIN = "elajans.link"
+FALLBACK_TRACKING_LINK = "elajans.link"
+
+# Maximum number of tracking link requests in flight at once (1 = sequential)
+TRACKING_LINK_CONCURRENCY = 32
+
+# Number of links sent per request when bulk link creation is enabled
+TRACKING_LINK_BATCH_SIZE = 50
+
+# Per-attempt timeout for tracking link requests, and retry policy for transient failures
+TRACKING_LINK_TIMEOUT = 10
+TRACKING_LINK_MAX_RETRIES = 3
+RETRY_BACKOFF_BASE = 0.5
+RETRY_BACKOFF_MAX = 8
+RETRYABLE_STATUSES = (429, 500, 502, 503, 504)
+
+# Consecutive tracking link failures that open the circuit breaker, and how long it
+# stays open before a single trial request is let through
+CIRCUIT_BREAKER_THRESHOLD = 5
+CIRCUIT_BREAKER_RESET_TIMEOUT = 30
+
+# Hedged tracking link requests: a duplicate is sent once a request has been
+# outstanding longer than this percentile of recent latencies (or the default
+# delay until enough samples have been seen)
+HEDGE_PERCENTILE = 95
+HEDGE_MIN_SAMPLES = 20
+HEDGE_DEFAULT_DELAY = 2.0
+
+# Upper bounds (milliseconds) of the latency histogram buckets in the timing report
+LATENCY_HISTOGRAM_BUCKETS_MS = (50, 100, 250, 500, 1000, 2500, 5000, 10000)
+
+# Default flash sale query. Filters are BigQuery query parameters rather than inlined
+# values (or current_date(), which makes results uncacheable), so identical parameter
+# values can be served from BigQuery's result cache. Grouping keeps one row per car and
+# day (as DISTINCT did) with its latest publish time, however often it was republished
+DEFAULT_QUERY = """SELECT a.car_name as sf_vehicle_name,
+a.vehicle_id as ajans_vehicle_id,
+DATE(a.log_date) AS published_at,
+b.car_make,
+b.car_model,
+b.car_year,
+b.kilometrage,
+CAST(MAX(a.log_date) AS TIMESTAMP) AS published_ts
+FROM ajans_dealers.wholesale_vehicle_activity_logs a 
+LEFT JOIN reporting.vehicle_acquisition_to_selling b ON a.car_name = b.car_name
+WHERE DATE(a.log_date) BETWEEN @start_date AND @end_date
+AND status_before = @status_before AND status_after = @status_after
+AND (@watermark IS NULL OR CAST(a.log_date AS TIMESTAMP) > @watermark)
+GROUP BY 1, 2, 3, 4, 5, 6, 7"""
+DEFAULT_STATUS_BEFORE = "created"
+DEFAULT_STATUS_AFTER = "published"
+
+# BigQuery types of the query parameters the generator can bind; a parameter is only
+# bound when the query references it
+QUERY_PARAMETER_TYPES = {
+    "start_date": "DATE",
+    "end_date": "DATE",
+    "status_before": "STRING",
+    "status_after": "STRING",
+    "watermark": "TIMESTAMP",
+}
+QUERY_PARAMETER_REFERENCE = re.compile(r"@(\w+)")
+
+# Columns a query must return, with the BigQuery types each may have (dry-run schemas
+# report legacy names such as INTEGER and FLOAT). published_ts is optional and only
+# type-checked when present; it must be a TIMESTAMP because @watermark is bound as one
+# and BigQuery won't compare it with a DATETIME (CAST the column AS TIMESTAMP)
+REQUIRED_COLUMN_TYPES = {
+    'sf_vehicle_name': ("STRING", "INTEGER", "INT64"),
+    'ajans_vehicle_id': ("STRING", "INTEGER", "INT64"),
+    'published_at': ("DATE", "DATETIME", "TIMESTAMP"),
+    'car_make': ("STRING",),
+    'car_model': ("STRING",),
+    'car_year': ("INTEGER", "INT64", "NUMERIC", "BIGNUMERIC", "FLOAT", "FLOAT64", "STRING"),
+    'kilometrage': ("INTEGER", "INT64", "NUMERIC", "BIGNUMERIC", "FLOAT", "FLOAT64", "STRING"),
+}
+OPTIONAL_COLUMN_TYPES = {
+    'published_ts': ("TIMESTAMP",),
+}
+
+# Pushdown mode wraps the query so BigQuery drops cars that can't be posted (no make,
+# model or ajans ID) and keeps one row per ajans_vehicle_id, preferring rows with
+# year and kilometrage and then the latest published_at
+PUSHDOWN_QUERY_TEMPLATE = """SELECT *
+FROM (
+{query}
+)
+WHERE car_make IS NOT NULL AND car_model IS NOT NULL
+AND NULLIF(TRIM(CAST(ajans_vehicle_id AS STRING)), '') IS NOT NULL
+QUALIFY ROW_NUMBER() OVER (
+  PARTITION BY ajans_vehicle_id
+  ORDER BY car_year IS NULL, kilometrage IS NULL, published_at DESC
+) = 1"""
+
+# Queries estimated (by a dry run) to scan more than this are rejected before running
+QUERY_MAX_BYTES_SCANNED = 10 * 1024 ** 3
+
+# Streaming mode: rows per result page, and how many pages of cars may be waiting
+# for tracking links before the next page download is held back. This bounds the
+# result download and the in-flight link requests only: car records and their
+# finished tasks (then posts) are kept for the whole run, since the posts are
+# delivered together and the watermark is computed from every car
+QUERY_PAGE_SIZE = 500
+STREAM_MAX_PENDING_PAGES = 2
+
+# Share of a run budget held back for webhook delivery once link creation stops,
+# capped at RUN_BUDGET_DELIVERY_RESERVE seconds so small budgets still leave time for links
+RUN_BUDGET_DELIVERY_RESERVE = 5
+RUN_BUDGET_DELIVERY_RESERVE_FRACTION = 0.2
+
+# Bulk endpoint statuses that mean "not supported here", switching to per-car requests
+BULK_UNAVAILABLE_STATUSES = (404, 405, 501)
+
+# Timeout in seconds for outbound HTTP requests
+HTTP_TIMEOUT = 30
+
+# Webhook delivery: posts per request, chunk requests in flight at once, and retries
+# of a chunk whose request fails with a transient error
+WEBHOOK_CHUNK_SIZE = 100
+WEBHOOK_CONCURRENCY = 4
+WEBHOOK_MAX_RETRIES = 2
+
+# Webhook body formats: "flat" (metadata plus post_1..post_N keys, the original format),
+# "array" (metadata plus a "posts" list) or "ndjson" (one post per line, streamed, with
+# the metadata in X-* headers)
+WEBHOOK_FORMATS = ("flat", "array", "ndjson")
+WEBHOOK_FORMAT = "flat"
+
+# Webhook body compression (sent with Content-Encoding) and the default level per encoding
+WEBHOOK_COMPRESSIONS = ("none", "gzip", "zstd")
+WEBHOOK_COMPRESSION = "none"
+WEBHOOK_COMPRESSION_LEVELS = {"gzip": 6, "zstd": 3}
+
+
+def settings_per_host(settings: Dict[str, object]) -> Dict[str, object]:
+    """
+    Key per-endpoint settings by host, as HTTP clients and rate limiters are shared per host
+    Raises ValueError if endpoints on the same host are configured differently
+    """
+    per_host = {}
+    for endpoint, setting in settings.items():
+        host = httpx.URL(endpoint).host
+        if per_host.get(host, setting) != setting:
+            raise ValueError(
+                f"{endpoint} is on host {host} together with an endpoint configured as {per_host[host]!r} "
+                f"instead of {setting!r}; point them at different hosts"
+            )
+        per_host[host] = setting
+    return per_host
+
+
+# Connection pool size per host for the shared HTTP clients, and how long idle
+# keep-alive connections are held open
+HTTP_POOL_SIZES = settings_per_host({
+    TRACKING_LINK_ENDPOINT: 64,
+    TRACKING_LINK_BULK_ENDPOINT: 64,
+    WEBHOOK_ENDPOINT: WEBHOOK_CONCURRENCY,
+})
+HTTP_DEFAULT_POOL_SIZE = 16
+HTTP_KEEPALIVE_EXPIRY = 120
+
+# Client-side rate limits (requests per second) are off unless set in the environment;
+# a 429 is still retried after its Retry-After either way
+TRACKING_LINK_RATE_LIMIT = float(os.environ.get("TRACKING_LINK_RATE_LIMIT", 0))
+WEBHOOK_RATE_LIMIT = float(os.environ.get("WEBHOOK_RATE_LIMIT", 0))
+
+# Configured rate limits per host as (requests per second, burst size); hosts not
+# listed are not throttled. A 429 halves the rate, successes slowly restore it
+HTTP_RATE_LIMITS = settings_per_host({
+    endpoint: (rate, max(1, int(rate)))
+    for endpoint, rate in (
+        (TRACKING_LINK_ENDPOINT, TRACKING_LINK_RATE_LIMIT),
+        (TRACKING_LINK_BULK_ENDPOINT, TRACKING_LINK_RATE_LIMIT),
+        (WEBHOOK_ENDPOINT, WEBHOOK_RATE_LIMIT),
+    )
+    if rate > 0
+})
+RATE_LIMIT_MIN_RATE = 0.5
+
+# Names used for external calls in the timing report
+ENDPOINT_LABELS = {
+    TRACKING_LINK_ENDPOINT: "nonito.create_tracking_link",
+    TRACKING_LINK_BULK_ENDPOINT: "nonito.create_tracking_links",
+    WEBHOOK_ENDPOINT: "n8n.webhook",
+}
+
+# Service account tokens are refreshed in the background this many seconds before they
+# expire; failed refreshes are retried after the retry interval
+CREDENTIALS_REFRESH_MARGIN = 5 * 60
+CREDENTIALS_RETRY_INTERVAL = 30
+
+# Local on-disk caches
+CACHE_DIR = os.environ.get("FLASH_SALE_CACHE_DIR", ".cache")
+TRACKING_LINK_CACHE_PATH = os.path.join(CACHE_DIR, "tracking_links.sqlite3")
+TRACKING_LINK_CACHE_TTL = 48 * 60 * 60
+TRACKING_LINK_CACHE_MAX_ENTRIES = 50000
+
+# Query result cache: entries expire after the TTL; the in-memory layer holds the most
+# recent results, the disk layer more; results larger than the row limit aren't cached
+QUERY_CACHE_PATH = os.path.join(CACHE_DIR, "query_results.sqlite3")
+QUERY_CACHE_TTL = 10 * 60
+QUERY_CACHE_MEMORY_ENTRIES = 16
+QUERY_CACHE_DISK_ENTRIES = 64
+QUERY_CACHE_MAX_ROWS = 100000
+
+# Output schemas of validated queries, keyed by normalized query text
+SCHEMA_CACHE_PATH = os.path.join(CACHE_DIR, "query_schemas.sqlite3")
+SCHEMA_CACHE_TTL = 24 * 60 * 60
+SCHEMA_CACHE_MAX_ENTRIES = 256
+
+# Webhook outbox: posts are stored here before delivery and stay pending until the
+# webhook accepts them. There is no background worker: pending posts are retried by the
+# next Generate run or the Resend button. A run claims the posts it sends for
+# OUTBOX_LEASE seconds so concurrent runs don't send them twice. After
+# OUTBOX_MAX_ATTEMPTS failed deliveries a post is parked until resent by hand; posts
+# older than the flash sale window are never sent, and finished entries are deleted
+# after the retention period
+OUTBOX_PATH = os.path.join(CACHE_DIR, "webhook_outbox.sqlite3")
+OUTBOX_LEASE = 15 * 60
+OUTBOX_MAX_ATTEMPTS = 5
+OUTBOX_MAX_AGE = 36 * 60 * 60
+OUTBOX_RETENTION = 7 * 24 * 60 * 60
+
+# Idempotency keys of posts already delivered (or queued in the outbox); cars whose
+# key is listed are skipped before any tracking link or webhook work. Keys include the
+# date, so entries only need to outlive the day
+POSTED_KEYS_PATH = os.path.join(CACHE_DIR, "posted_keys.sqlite3")
+POSTED_KEYS_TTL = 48 * 60 * 60
+POSTED_KEYS_MAX_ENTRIES = 50000
+
+# Incremental mode: the latest published_ts successfully delivered per query, bound to
+# the query as @watermark so later runs only fetch cars published after it
+WATERMARK_PATH = os.path.join(CACHE_DIR, "watermarks.sqlite3")
+WATERMARK_TTL = 7 * 24 * 60 * 60
+WATERMARK_MAX_ENTRIES = 100
+WATERMARK_PARAMETER = re.compile(r"@watermark\b", re.IGNORECASE)
+
+
+def format_bytes(num_bytes: float) -> str:
+    """Human-readable byte count, e.g. 1.5 GB"""
+    for unit in ("B", "KB", "MB", "GB", "TB"):
+        if abs(num_bytes) < 1024 or unit == "TB":
+            return f"{num_bytes:.0f} {unit}" if unit == "B" else f"{num_bytes:.1f} {unit}"
+        num_bytes /= 1024
+
+
+class NDJSONBody:
+    """
+    Newline-delimited JSON request body, encoded one record at a time as it is sent
+    Iterating again starts over, so retried requests can resend it
+    """
+
+    def __init__(self, records: List[Dict]):
+        self.records = records
+
+    async def __aiter__(self):
+        for record in self.records:
+            yield (json.dumps(record, ensure_ascii=False, default=str) + "\n").encode("utf-8")
+
+
+def make_compressor(encoding: str, level: int):
+    """Incremental compressor (compress()/flush()) for a Content-Encoding of gzip or zstd"""
+    if encoding == "gzip":
+        return zlib.compressobj(level, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+    if encoding == "zstd":
+        return zstandard.ZstdCompressor(level=level).compressobj()
+    raise ValueError(f"unsupported content encoding: {encoding}")
+
+
+def compress_body(body: bytes, encoding: str, level: int) -> bytes:
+    compressor = make_compressor(encoding, level)
+    return compressor.compress(body) + compressor.flush()
+
+
+class CompressedBody:
+    """
+    Streamed request body compressed on the fly; like NDJSONBody it can be
+    iterated again for a retry
+    """
+
+    def __init__(self, source, encoding: str, level: int):
+        self.source = source
+        self.encoding = encoding
+        self.level = level
+
+    async def __aiter__(self):
+        compressor = make_compressor(self.encoding, self.level)
+        async for piece in self.source:
+            compressed = compressor.compress(piece)
+            if compressed:
+                yield compressed
+        yield compressor.flush()
+
+
+class SQLiteTTLCache:
+    """
+    Small key/value cache stored in a SQLite file
+    Entries expire after ttl seconds; the least recently used entries are
+    evicted once the cache holds more than max_entries
+    """
+
+    def __init__(self, path: str, ttl: float, max_entries: int):
+        self.path = path
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        with self._lock, self._conn:
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS cache ("
+                "key TEXT PRIMARY KEY, value TEXT NOT NULL, "
+                "created_at REAL NOT NULL, accessed_at REAL NOT NULL)"
+            )
+            self._conn.execute("CREATE INDEX IF NOT EXISTS cache_accessed_at ON cache (accessed_at)")
+        self.prune()
+
+    def get(self, key: str) -> Optional[str]:
+        """Return the cached value, or None if it is missing or expired"""
+        now = time.time()
+        with self._lock, self._conn:
+            row = self._conn.execute(
+                "SELECT value, created_at FROM cache WHERE key = ?", (key,)
+            ).fetchone()
+            if row is None:
+                return None
+            if now - row[1] > self.ttl:
+                self._conn.execute("DELETE FROM cache WHERE key = ?", (key,))
+                return None
+            self._conn.execute("UPDATE cache SET accessed_at = ? WHERE key = ?", (now, key))
+            return row[0]
+
+    def set(self, key: str, value: str):
+        now = time.time()
+        with self._lock, self._conn:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO cache (key, value, created_at, accessed_at) VALUES (?, ?, ?, ?)",
+                (key, value, now, now)
+            )
+
+    def prune(self):
+        """Drop expired entries and evict the least recently used ones above max_entries"""
+        with self._lock, self._conn:
+            self._conn.execute("DELETE FROM cache WHERE created_at < ?", (time.time() - self.ttl,))
+            self._conn.execute(
+                "DELETE FROM cache WHERE key IN ("
+                "SELECT key FROM cache ORDER BY accessed_at DESC LIMIT -1 OFFSET ?)",
+                (self.max_entries,)
+            )
+
+    def clear(self):
+        with self._lock, self._conn:
+            self._conn.execute("DELETE FROM cache")
+
+
+class WebhookOutbox:
+    """
+    Durable queue of posts awaiting webhook delivery, stored in a SQLite file
+    Posts are added before they are sent and acknowledged once the webhook accepts
+    them, so a failed delivery can be retried without regenerating anything
+    (at-least-once: a post may be sent again if an acknowledgement is lost)
+    """
+
+    def __init__(self, path: str, max_attempts: int = OUTBOX_MAX_ATTEMPTS):
+        self.path = path
+        self.max_attempts = max_attempts
+        self._lock = threading.Lock()
+
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        with self._lock, self._conn:
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS outbox ("
+                "id INTEGER PRIMARY KEY AUTOINCREMENT, run_id TEXT NOT NULL, post TEXT NOT NULL, "
+                "status TEXT NOT NULL DEFAULT 'pending', attempts INTEGER NOT NULL DEFAULT 0, "
+                "last_error TEXT, created_at REAL NOT NULL, updated_at REAL NOT NULL, lease_until REAL)"
+            )
+            self._conn.execute("CREATE INDEX IF NOT EXISTS outbox_status ON outbox (status, id)")
+            # Outboxes created before leases were added
+            columns = {row[1] for row in self._conn.execute("PRAGMA table_info(outbox)")}
+            if "lease_until" not in columns:
+                self._conn.execute("ALTER TABLE outbox ADD COLUMN lease_until REAL")
+
+    def add(self, run_id: str, posts: List[Dict]) -> List[int]:
+        """Store posts as pending; returns their outbox IDs in order"""
+        now = time.time()
+        with self._lock, self._conn:
+            return [
+                self._conn.execute(
+                    "INSERT INTO outbox (run_id, post, created_at, updated_at) VALUES (?, ?, ?, ?)",
+                    (run_id, json.dumps(post, ensure_ascii=False, default=str), now, now)
+                ).lastrowid
+                for post in posts
+            ]
+
+    def claim(self, include_failed: bool = False, lease: float = OUTBOX_LEASE) -> List[tuple]:
+        """
+        (id, post) for every post awaiting delivery, oldest first, marked as 'sending'
+        for lease seconds so other runs leave them alone until they are acked, failed
+        or released; posts whose lease ran out (the run died) can be claimed again
+        """
+        statuses = ("pending", "failed") if include_failed else ("pending",)
+        now = time.time()
+        with self._lock, self._conn:
+            # IMMEDIATE takes the write lock up front, so other processes can't claim the same rows
+            self._conn.execute("BEGIN IMMEDIATE")
+            rows = self._conn.execute(
+                f"SELECT id, post FROM outbox WHERE status IN ({', '.join('?' * len(statuses))}) "
+                "OR (status = 'sending' AND lease_until < ?) ORDER BY id",
+                (*statuses, now)
+            ).fetchall()
+            self._conn.executemany(
+                "UPDATE outbox SET status = 'sending', lease_until = ?, updated_at = ? WHERE id = ?",
+                [(now + lease, now, row[0]) for row in rows]
+            )
+        return [(row[0], json.loads(row[1])) for row in rows]
+
+    def release(self, ids: List[int]):
+        """Return claimed posts that were not sent to pending"""
+        with self._lock, self._conn:
+            self._conn.executemany(
+                "UPDATE outbox SET status = 'pending', lease_until = NULL, updated_at = ? "
+                "WHERE id = ? AND status = 'sending'",
+                [(time.time(), post_id) for post_id in ids]
+            )
+
+    def ack(self, ids: List[int]):
+        """Mark posts as delivered"""
+        with self._lock, self._conn:
+            self._conn.executemany(
+                "UPDATE outbox SET status = 'delivered', last_error = NULL, lease_until = NULL, "
+                "updated_at = ? WHERE id = ?",
+                [(time.time(), post_id) for post_id in ids]
+            )
+
+    def fail(self, ids: List[int], error: str):
+        """Record a failed delivery; posts out of attempts are parked as failed"""
+        with self._lock, self._conn:
+            self._conn.executemany(
+                "UPDATE outbox SET attempts = attempts + 1, last_error = ?, updated_at = ?, lease_until = NULL, "
+                "status = CASE WHEN attempts + 1 >= ? THEN 'failed' ELSE 'pending' END WHERE id = ?",
+                [(error, time.time(), self.max_attempts, post_id) for post_id in ids]
+            )
+
+    def expire(self, max_age: float) -> int:
+        """Stop delivering undelivered posts older than max_age; returns how many expired"""
+        with self._lock, self._conn:
+            return self._conn.execute(
+                "UPDATE outbox SET status = 'expired', updated_at = ? "
+                "WHERE status IN ('pending', 'failed') AND created_at < ?",
+                (time.time(), time.time() - max_age)
+            ).rowcount
+
+    def prune(self, retention: float):
+        """Delete delivered and expired entries last updated before the retention period"""
+        with self._lock, self._conn:
+            self._conn.execute(
+                "DELETE FROM outbox WHERE status IN ('delivered', 'expired') AND updated_at < ?",
+                (time.time() - retention,)
+            )
+
+    def counts(self) -> Dict[str, int]:
+        """Number of entries per status"""
+        with self._lock:
+            rows = self._conn.execute("SELECT status, COUNT(*) FROM outbox GROUP BY status").fetchall()
+        return {status: 0 for status in ("pending", "sending", "failed", "delivered", "expired")} | dict(rows)
+
+
+class QueryResultCache:
+    """
+    Car records per query, keyed by the normalized SQL text and the business date
+    An in-process LRU sits in front of a SQLiteTTLCache so results survive restarts
+    """
+
+    # Quoted string literals and backtick-quoted identifiers (case-sensitive table
+    # names), kept as-is when normalizing
+    _LITERAL = re.compile(r"('(?:[^'\\]|\\.)*'|\"(?:[^\"\\]|\\.)*\"|`(?:[^`\\]|\\.)*`)")
+
+    def __init__(self, path: str, ttl: float, memory_entries: int, disk_entries: int):
+        self.ttl = ttl
+        self.memory_entries = memory_entries
+        self._memory: OrderedDict = OrderedDict()
+        self._lock = threading.Lock()
+        self.disk = SQLiteTTLCache(path, ttl, disk_entries)
+        self.hits = 0
+        self.misses = 0
+
+    @classmethod
+    def normalize_query(cls, query: str) -> str:
+        """Collapse whitespace and lowercase everything outside string literals and backtick-quoted names"""
+        parts = cls._LITERAL.split(query.strip())
+        return "".join(
+            part if i % 2 else re.sub(r"\s+", " ", part).lower()
+            for i, part in enumerate(parts)
+        )
+
+    def key(self, query: str, parameters: tuple = ()) -> str:
+        """
+        Cache key for a query and its (name, type, value) parameters as of today's date
+        (current_date() is UTC in BigQuery)
+        """
+        business_date = datetime.now(timezone.utc).date().isoformat()
+        bound = ",".join(f"{name}={value}" for name, _, value in parameters)
+        text = f"{self.normalize_query(query)}|{bound}|{business_date}"
+        return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+    def get(self, key: str) -> Optional[List[Dict]]:
+        with self._lock:
+            entry = self._memory.get(key)
+            if entry is not None and time.time() - entry[0] <= self.ttl:
+                self._memory.move_to_end(key)
+                self.hits += 1
+                return entry[1]
+            self._memory.pop(key, None)
+
+        value = self.disk.get(key)
+        if value is None:
+            with self._lock:
+                self.misses += 1
+            return None
+
+        try:
+            cars = json.loads(value)
+            for car_data in cars:
+                if car_data.get('published_at'):
+                    car_data['published_at'] = date.fromisoformat(car_data['published_at'][:10])
+                if car_data.get('published_ts'):
+                    car_data['published_ts'] = datetime.fromisoformat(car_data['published_ts'])
+        except ValueError:
+            # Entries written before nulls were serialized as None hold 'NaT'; refetch them
+            with self._lock:
+                self.misses += 1
+            return None
+        self._remember(key, cars)
+        with self._lock:
+            self.hits += 1
+        return cars
+
+    def set(self, key: str, cars: List[Dict]):
+        self._remember(key, cars)
+        self.disk.set(key, json.dumps(cars, default=self._json_default))
+
+    @staticmethod
+    def _json_default(value):
+        """Serialize missing timestamps (NaT) as null, everything else as text."""
+        return None if value is pd.NaT else str(value)
+
+    def _remember(self, key: str, cars: List[Dict]):
+        with self._lock:
+            self._memory[key] = (time.time(), cars)
+            self._memory.move_to_end(key)
+            while len(self._memory) > self.memory_entries:
+                self._memory.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._memory.clear()
+        self.disk.clear()
+
+
+class CircuitOpenError(Exception):
+    """Raised when a request is refused because the circuit breaker is open"""
+
+
+class LatencyTracker:
+    """
+    Keeps recent latency samples (seconds) and reports percentiles
+    """
+
+    def __init__(self, max_samples: int = 10000):
+        self.samples = deque(maxlen=max_samples)
+
+    def record(self, seconds: float):
+        self.samples.append(seconds)
+
+    def __len__(self) -> int:
+        return len(self.samples)
+
+    def percentile(self, percent: float) -> Optional[float]:
+        """Nearest-rank percentile of the recorded samples, or None if there are none"""
+        if not self.samples:
+            return None
+        ordered = sorted(self.samples)
+        rank = max(1, math.ceil(percent / 100 * len(ordered)))
+        return ordered[rank - 1]
+
+    def histogram(self, bounds_ms=LATENCY_HISTOGRAM_BUCKETS_MS) -> Dict[str, int]:
+        """Count samples per latency bucket, labelled by the bucket's upper bound"""
+        counts = {f"<={bound}ms": 0 for bound in bounds_ms}
+        counts[f">{bounds_ms[-1]}ms"] = 0
+        for seconds in self.samples:
+            milliseconds = seconds * 1000
+            for bound in bounds_ms:
+                if milliseconds <= bound:
+                    counts[f"<={bound}ms"] += 1
+                    break
+            else:
+                counts[f">{bounds_ms[-1]}ms"] += 1
+        return counts
+
+
+class SendSignal(asyncio.Event):
+    """
+    Event set once a request is first sent (after any rate-limit wait), noting when
+    """
+
+    def __init__(self):
+        super().__init__()
+        self.sent_at: Optional[float] = None
+
+    def set(self):
+        if self.sent_at is None:
+            self.sent_at = time.perf_counter()
+        super().set()
+
+
+class RunTimings:
+    """
+    Wall-clock time per pipeline stage and latency samples per external call
+    """
 
-class FlashSalePostGenerator:
     def __init__(self):
+        self.stages: Dict[str, float] = {}
+        self.calls: Dict[str, LatencyTracker] = {}
+
+    @contextmanager
+    def stage(self, name: str):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.stages[name] = self.stages.get(name, 0.0) + time.perf_counter() - started
+
+    def record_call(self, name: str, seconds: float):
+        self.calls.setdefault(name, LatencyTracker()).record(seconds)
+
+    def to_dict(self) -> Dict:
+        """JSON-serializable report for dashboards"""
+        calls = {}
+        for name, tracker in self.calls.items():
+            calls[name] = {
+                "count": len(tracker),
+                "total_seconds": round(sum(tracker.samples), 4),
+                "p50_ms": round(tracker.percentile(50) * 1000, 1),
+                "p95_ms": round(tracker.percentile(95) * 1000, 1),
+                "p99_ms": round(tracker.percentile(99) * 1000, 1),
+                "max_ms": round(max(tracker.samples) * 1000, 1),
+                "histogram": tracker.histogram()
+            }
+        return {
+            "stages": {name: round(seconds, 4) for name, seconds in self.stages.items()},
+            "calls": calls
+        }
+
+    def to_frame(self) -> pd.DataFrame:
+        """One row per stage and per external call, for display in Streamlit"""
+        report = self.to_dict()
+        rows = [
+            {"Type": "stage", "Name": name, "Count": 1, "Total (s)": seconds}
+            for name, seconds in report["stages"].items()
+        ]
+        for name, call in report["calls"].items():
+            rows.append({
+                "Type": "call",
+                "Name": name,
+                "Count": call["count"],
+                "Total (s)": call["total_seconds"],
+                "p50 (ms)": call["p50_ms"],
+                "p95 (ms)": call["p95_ms"],
+                "p99 (ms)": call["p99_ms"],
+                "Max (ms)": call["max_ms"]
+            })
+        return pd.DataFrame(rows)
+
+
+class RunBudgetExceeded(Exception):
+    """Raised when a request would start after the run's time budget has run out"""
+
+
+class CircuitBreaker:
+    """
+    Consecutive-failure circuit breaker
+    Opens after failure_threshold failures in a row and rejects requests until
+    reset_timeout has passed, then lets one trial request through (half-open)
+    """
+
+    def __init__(self, failure_threshold: int = CIRCUIT_BREAKER_THRESHOLD,
+                 reset_timeout: float = CIRCUIT_BREAKER_RESET_TIMEOUT):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.state = "closed"
+        self.consecutive_failures = 0
+        self.opened_at = 0.0
+
+    def allow_request(self) -> bool:
+        if self.state == "closed":
+            return True
+        if self.state == "open" and time.monotonic() - self.opened_at >= self.reset_timeout:
+            self.state = "half_open"
+            return True
+        # Open, or half-open with the trial request still in flight
+        return False
+
+    def record_success(self):
+        self.state = "closed"
+        self.consecutive_failures = 0
+
+    def record_failure(self):
+        self.consecutive_failures += 1
+        if self.state == "half_open" or self.consecutive_failures >= self.failure_threshold:
+            self.state = "open"
+            self.opened_at = time.monotonic()
+
+
+class TokenBucket:
+    """
+    Async token-bucket rate limiter that adapts to server back-pressure
+    Used only from the runtime event loop, so no locking is needed
+    """
+
+    def __init__(self, rate: float, capacity: int):
+        self.max_rate = rate
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = float(capacity)
+        self.updated_at = time.monotonic()
+        self.paused_until = 0.0
+        self.waiting = 0
+        self.max_waiting = 0
+
+    def _refill(self, now: float):
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated_at) * self.rate)
+        self.updated_at = now
+
+    async def acquire(self):
+        """Wait until a request may be sent"""
+        self.waiting += 1
+        self.max_waiting = max(self.max_waiting, self.waiting)
+        try:
+            while True:
+                now = time.monotonic()
+                if now < self.paused_until:
+                    await asyncio.sleep(self.paused_until - now)
+                    continue
+                self._refill(now)
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                await asyncio.sleep((1 - self.tokens) / self.rate)
+        finally:
+            self.waiting -= 1
+
+    def throttle(self, retry_after: Optional[float] = None):
+        """Back off after a 429: halve the rate and pause for retry_after seconds"""
+        now = time.monotonic()
+        self._refill(now)
+        self.rate = max(RATE_LIMIT_MIN_RATE, self.rate / 2)
+        self.tokens = 0.0
+        if retry_after:
+            self.paused_until = max(self.paused_until, now + retry_after)
+
+    def recover(self):
+        """Step the rate back up towards max_rate after a successful request"""
+        if self.rate < self.max_rate:
+            self._refill(time.monotonic())
+            self.rate = min(self.max_rate, self.rate + self.max_rate / 20)
+
+    def set_max_rate(self, rate: float):
+        """Change the configured rate; an adaptively lowered rate keeps recovering from where it is"""
+        self._refill(time.monotonic())
+        was_at_max = self.rate >= self.max_rate
+        self.max_rate = rate
+        self.rate = rate if was_at_max else min(self.rate, rate)
+
+
+# Streamlit session context of the run the current task on the runtime loop belongs to
+_session_ctx: contextvars.ContextVar = contextvars.ContextVar("flash_sale_session_ctx", default=None)
+
+
+class SessionContextThread(threading.Thread):
+    """
+    Thread whose Streamlit script run context is kept per asyncio task rather than
+    per thread, so runs from several sessions can share one event loop
+    """
+
+
+# get_script_run_ctx/add_script_run_ctx read and write this thread attribute
+setattr(SessionContextThread, SCRIPT_RUN_CONTEXT_ATTR_NAME, property(
+    lambda thread: _session_ctx.get(),
+    lambda thread, ctx: _session_ctx.set(ctx),
+))
+
+
+class AsyncHTTPRuntime:
+    """
+    Background event loop that owns long-lived, pooled HTTP clients
+    One httpx.AsyncClient is kept per host so keep-alive connections are
+    reused across cars, runs and Streamlit reruns
+    """
+
+    def __init__(self, pool_sizes: Dict[str, int], rate_limits: Dict[str, tuple]):
+        self.pool_sizes = pool_sizes
+        self.loop = asyncio.new_event_loop()
+        self._clients: Dict[str, httpx.AsyncClient] = {}
+        self.limiters: Dict[str, TokenBucket] = {
+            host: TokenBucket(rate, capacity) for host, (rate, capacity) in rate_limits.items()
+        }
+        # Runs from different sessions proceed concurrently; each run's tasks carry its own session context
+        self._thread = SessionContextThread(target=self.loop.run_forever, name="flash-sale-http", daemon=True)
+        self._thread.start()
+
+    def client(self, url: str) -> httpx.AsyncClient:
+        """Return the pooled client for the host of url (must be called on the runtime loop)"""
+        host = httpx.URL(url).host
+        client = self._clients.get(host)
+        if client is None:
+            pool_size = self.pool_sizes.get(host, HTTP_DEFAULT_POOL_SIZE)
+            client = httpx.AsyncClient(
+                limits=httpx.Limits(
+                    max_connections=pool_size,
+                    max_keepalive_connections=pool_size,
+                    keepalive_expiry=HTTP_KEEPALIVE_EXPIRY
+                ),
+                timeout=HTTP_TIMEOUT
+            )
+            self._clients[host] = client
+        return client
+
+    def limiter(self, url: str) -> Optional[TokenBucket]:
+        """Return the rate limiter for the host of url, if that host is throttled"""
+        return self.limiters.get(httpx.URL(url).host)
+
+    def set_rate_limit(self, url: str, rate: float):
+        """Change the maximum request rate for the host of url (0 disables throttling)"""
+        host = httpx.URL(url).host
+        if rate <= 0:
+            self.limiters.pop(host, None)
+        elif host in self.limiters:
+            self.limiters[host].set_max_rate(rate)
+        else:
+            self.limiters[host] = TokenBucket(rate, max(1, int(rate)))
+
+    def run(self, coro):
+        """Run a coroutine on the runtime loop and block until it finishes"""
+        ctx = get_script_run_ctx()
+
+        async def attached():
+            # Let st.* calls made by the coroutine (and the tasks it starts, which copy
+            # its context) render in the calling session
+            if ctx is not None:
+                add_script_run_ctx(threading.current_thread(), ctx)
+            return await coro
+
+        future = asyncio.run_coroutine_threadsafe(attached(), self.loop)
+        try:
+            return future.result()
+        except BaseException:
+            # Streamlit stops the script thread on rerun; don't leave work running
+            future.cancel()
+            raise
+
+
+class CredentialsRefresher:
+    """
+    Holds service account credentials and refreshes their access token from a daemon
+    thread shortly before it expires, so BigQuery calls never wait on a token fetch
+    """
+
+    def __init__(self, credentials, source: str, margin: float = CREDENTIALS_REFRESH_MARGIN):
+        self.credentials = credentials
+        self.source = source
+        self.margin = margin
+        self.refreshes = 0
+        self.last_error: Optional[Exception] = None
+        self._thread = threading.Thread(target=self._refresh_forever, name="credentials-refresher", daemon=True)
+        self._thread.start()
+
+    def _seconds_until_refresh(self) -> float:
+        expiry = self.credentials.expiry  # naive UTC, as google-auth stores it
+        if not self.credentials.valid or expiry is None:
+            return 0.0
+        now = datetime.now(timezone.utc).replace(tzinfo=None)
+        return (expiry - now).total_seconds() - self.margin
+
+    def _refresh_forever(self):
+        request = google.auth.transport.requests.Request()
+        while True:
+            wait = self._seconds_until_refresh()
+            if wait <= 0:
+                try:
+                    self.credentials.refresh(request)
+                    self.refreshes += 1
+                    self.last_error = None
+                    wait = max(self._seconds_until_refresh(), CREDENTIALS_RETRY_INTERVAL)
+                except Exception as e:
+                    self.last_error = e
+                    logging.getLogger(__name__).warning("BigQuery token refresh failed: %s", e)
+                    wait = CREDENTIALS_RETRY_INTERVAL
+            time.sleep(wait)
+
+
+def load_service_account_credentials() -> tuple:
+    """
+    Load service account credentials from Streamlit secrets, falling back to service_account.json
+    Returns: (credentials, source); raises FileNotFoundError if neither is available
+    """
+    # Scoped up front so the client uses (and the refresher refreshes) this same object
+    try:
+        credentials = service_account.Credentials.from_service_account_info(
+            st.secrets["service_account"], scopes=bigquery.Client.SCOPE
+        )
+        return credentials, "Streamlit secrets"
+    except (KeyError, FileNotFoundError):
+        credentials = service_account.Credentials.from_service_account_file(
+            'service_account.json', scopes=bigquery.Client.SCOPE
+        )
+        return credentials, "service_account.json"
+
+
+@st.cache_resource
+def get_credentials_refresher() -> CredentialsRefresher:
+    """
+    Process-wide service account credentials, kept fresh in the background
+    Raises if none are found; failures aren't cached, so adding credentials takes effect on the next rerun
+    """
+    return CredentialsRefresher(*load_service_account_credentials())
+
+
+@st.cache_resource
+def get_bigquery_client() -> bigquery.Client:
+    """Process-wide BigQuery client shared by every generator and Streamlit rerun"""
+    return bigquery.Client(credentials=get_credentials_refresher().credentials)
+
+
+@st.cache_resource
+def get_bigquery_storage_client():
+    """Process-wide BigQuery Storage Read API client (requires google-cloud-bigquery-storage)"""
+    return bigquery_storage.BigQueryReadClient(credentials=get_credentials_refresher().credentials)
+
+
+@st.cache_resource
+def get_http_runtime() -> AsyncHTTPRuntime:
+    """Process-wide HTTP runtime shared by every generator and Streamlit rerun"""
+    return AsyncHTTPRuntime(HTTP_POOL_SIZES, HTTP_RATE_LIMITS)
+
+
+@st.cache_resource(max_entries=64)
+def get_query_job_config(parameters: tuple, maximum_bytes_billed: Optional[int],
+                         dry_run: bool = False) -> bigquery.QueryJobConfig:
+    """
+    Job configuration for a tuple of (name, type, value) query parameters, built once per
+    distinct combination and reused (the client copies it before starting each job)
+    """
+    job_config = bigquery.QueryJobConfig(
+        query_parameters=[bigquery.ScalarQueryParameter(*parameter) for parameter in parameters]
+    )
+    if dry_run:
+        job_config.dry_run = True
+        job_config.use_query_cache = False
+    elif maximum_bytes_billed is not None:
+        job_config.maximum_bytes_billed = maximum_bytes_billed
+    return job_config
+
+
+@st.cache_resource
+def get_schema_cache() -> SQLiteTTLCache:
+    """Process-wide cache of query output schemas shared by every generator and Streamlit rerun"""
+    return SQLiteTTLCache(SCHEMA_CACHE_PATH, SCHEMA_CACHE_TTL, SCHEMA_CACHE_MAX_ENTRIES)
+
+
+@st.cache_resource
+def get_webhook_outbox() -> WebhookOutbox:
+    """Process-wide webhook outbox shared by every generator and Streamlit rerun"""
+    return WebhookOutbox(OUTBOX_PATH)
+
+
+@st.cache_resource
+def get_query_cache() -> QueryResultCache:
+    """Process-wide query result cache shared by every generator and Streamlit rerun"""
+    return QueryResultCache(QUERY_CACHE_PATH, QUERY_CACHE_TTL, QUERY_CACHE_MEMORY_ENTRIES, QUERY_CACHE_DISK_ENTRIES)
+
+
+@st.cache_resource
+def get_link_cache() -> SQLiteTTLCache:
+    """Process-wide tracking link cache shared by every generator and Streamlit rerun"""
+    return SQLiteTTLCache(TRACKING_LINK_CACHE_PATH, TRACKING_LINK_CACHE_TTL, TRACKING_LINK_CACHE_MAX_ENTRIES)
+
+
+@st.cache_resource
+def get_watermark_store() -> SQLiteTTLCache:
+    """Process-wide incremental mode watermarks shared by every generator and Streamlit rerun"""
+    return SQLiteTTLCache(WATERMARK_PATH, WATERMARK_TTL, WATERMARK_MAX_ENTRIES)
+
+
+@st.cache_resource
+def get_posted_keys() -> SQLiteTTLCache:
+    """Process-wide index of posted idempotency keys shared by every generator and Streamlit rerun"""
+    return SQLiteTTLCache(POSTED_KEYS_PATH, POSTED_KEYS_TTL, POSTED_KEYS_MAX_ENTRIES)
+
+
+class FlashSalePostGenerator:
+    def __init__(self, link_concurrency: int = TRACKING_LINK_CONCURRENCY, use_link_cache: bool = True,
+                 bulk_links: bool = False, link_batch_size: int = TRACKING_LINK_BATCH_SIZE,
+                 link_max_retries: int = TRACKING_LINK_MAX_RETRIES,
+                 link_rate_limit: Optional[float] = None, run_budget: Optional[float] = None,
+                 hedge_links: bool = False, use_storage_api: bool = False,
+                 stream_results: bool = False, page_size: int = QUERY_PAGE_SIZE,
+                 use_query_cache: bool = True, force_refresh: bool = False,
+                 max_bytes_scanned: Optional[int] = QUERY_MAX_BYTES_SCANNED, incremental: bool = False,
+                 start_date: Optional[date] = None, end_date: Optional[date] = None,
+                 status_before: str = DEFAULT_STATUS_BEFORE, status_after: str = DEFAULT_STATUS_AFTER,
+                 pushdown_filters: bool = False, webhook_chunk_size: int = WEBHOOK_CHUNK_SIZE,
+                 webhook_concurrency: int = WEBHOOK_CONCURRENCY, webhook_max_retries: int = WEBHOOK_MAX_RETRIES,
+                 webhook_format: str = WEBHOOK_FORMAT, webhook_compression: str = WEBHOOK_COMPRESSION,
+                 webhook_compression_level: Optional[int] = None, use_outbox: bool = True,
+                 skip_posted: bool = True):
         st.info("🚀 Initializing Flash Sale Post Generator")
 
+        # Maximum number of tracking link requests in flight at once
+        self.link_concurrency = max(1, int(link_concurrency))
+
+        # Bulk link creation sends link_batch_size links per request
+        self.bulk_links = bulk_links
+        self.link_batch_size = max(1, int(link_batch_size))
+
+        # Transient tracking link failures are retried; repeated failures open the breaker
+        self.link_max_retries = max(0, int(link_max_retries))
+        self.link_breaker = CircuitBreaker()
+
+        # Retried requests per endpoint (labelled as in the timing report)
+        self.retries: Dict[str, int] = {}
+
+        # Posts are delivered to the webhook in chunks, several at a time; the outcome
+        # of each chunk of the latest delivery is kept in webhook_outcomes
+        self.webhook_chunk_size = max(1, int(webhook_chunk_size))
+        self.webhook_concurrency = max(1, int(webhook_concurrency))
+        self.webhook_max_retries = max(0, int(webhook_max_retries))
+        self.webhook_outcomes: List[Dict] = []
+        if webhook_format not in WEBHOOK_FORMATS:
+            raise ValueError(f"webhook_format must be one of {', '.join(WEBHOOK_FORMATS)}")
+        self.webhook_format = webhook_format
+
+        # Posts wait in a durable outbox until the webhook acknowledges them
+        self.outbox = get_webhook_outbox() if use_outbox else None
+
+        # Cars already posted today (by idempotency key) are skipped
+        self.posted_keys = get_posted_keys() if skip_posted else None
+        self.skipped_posted = 0
+
+        # Webhook bodies can be compressed; zstd needs the optional zstandard package
+        if webhook_compression not in WEBHOOK_COMPRESSIONS:
+            raise ValueError(f"webhook_compression must be one of {', '.join(WEBHOOK_COMPRESSIONS)}")
+        if webhook_compression == "zstd" and zstandard is None:
+            st.warning("⚠️ zstandard is not installed - compressing webhook bodies with gzip instead")
+            webhook_compression = "gzip"
+        self.webhook_compression = webhook_compression
+        self.webhook_compression_level = (
+            webhook_compression_level if webhook_compression_level is not None
+            else WEBHOOK_COMPRESSION_LEVELS.get(webhook_compression)
+        )
+
+        # Slow tracking link requests can be hedged with a duplicate (link_name is deterministic)
+        self.hedge_links = hedge_links
+        self.link_latency = LatencyTracker()  # per link, for the report
+        self.link_attempt_latency = LatencyTracker()  # per request attempt, for the hedge delay
+        self.link_requests = 0
+        self.link_hedges = 0
+
+        # Optional total time budget (seconds) for a generate -> webhook run. Requests
+        # are clamped to _request_deadline and unfinished cars are cancelled
+        self.run_budget = run_budget if run_budget and run_budget > 0 else None
+        self._run_deadline: Optional[float] = None
+        self._request_deadline: Optional[float] = None
+
+        # Download query results as Arrow through the BigQuery Storage Read API
+        self.use_storage_api = use_storage_api
+
+        # Byte ceiling enforced by a dry run before any query executes (None = no limit)
+        self.max_bytes_scanned = max_bytes_scanned if max_bytes_scanned and max_bytes_scanned > 0 else None
+
+        # Dry runs of this generator, and output schemas of queries validated before
+        self._dry_runs: Dict[tuple, Dict] = {}
+        self.schema_cache = get_schema_cache()
+
+        # Reuse results of identical queries run earlier today, unless a refresh is forced
+        self.query_cache = get_query_cache() if use_query_cache else None
+        self.force_refresh = force_refresh
+        self.query_cache_hit: Optional[bool] = None
+
+        # Query parameter values; an unset date range means the current business date (UTC)
+        self.start_date = start_date
+        self.end_date = end_date
+        self.status_before = status_before
+        self.status_after = status_after
+
+        # Filter out unpostable cars and duplicate vehicles in BigQuery rather than locally
+        self.pushdown_filters = pushdown_filters
+
+        # Incremental mode: only fetch cars published after the last delivered watermark
+        self.watermarks = get_watermark_store() if incremental else None
+        self._last_query: Optional[str] = None
+        self._pending_watermark: Optional[datetime] = None
+
+        # Stream query results page by page, creating links while later pages download
+        self.stream_results = stream_results
+        self.page_size = max(1, int(page_size))
+
+        # Stage and external call timings of the latest run
+        self.timings = RunTimings()
+        self._run_active = False
+        self._run_started = 0.0
+
+        # Tracking links already created today are reused from the on-disk cache
+        self.link_cache = get_link_cache() if use_link_cache else None
+        self.link_cache_hits = 0
+        self.link_cache_misses = 0
+
+        # Shared event loop, pooled HTTP clients and per-host rate limiters. A link rate
+        # limit given here replaces the shared one for this generator's runs only (0 = none)
+        self.http_runtime = get_http_runtime()
+        self.link_rate_limit = link_rate_limit
+        self.link_limiter = TokenBucket(
+            link_rate_limit, max(1, int(link_rate_limit))
+        ) if link_rate_limit else None
+
         # Initialize BigQuery client using service account credentials
         self.client = self._get_bigquery_client()
 
@@ -96,51 +1260,58 @@ class FlashSalePostGenerator:
     
     def validate_query_columns(self, query: str) -> tuple[bool, list]:
         """
-        Validate that the query contains the required column names
-        Returns: (is_valid, missing_columns)
-        """
-        required_columns = [
-            'sf_vehicle_name',
-            'ajans_vehicle_id', 
-            'published_at',
-            'car_make',
-            'car_model',
-            'car_year',
-            'kilometrage'
-        ]
-        
-        # Convert query to lowercase for case-insensitive checking
-        query_lower = query.lower()
-        missing_columns = []
-        
-        for column in required_columns:
-            # Check if column name appears in the query (as alias or column name)
-            if column.lower() not in query_lower:
-                missing_columns.append(column)
-        
-        is_valid = len(missing_columns) == 0
-        return is_valid, missing_columns
+        Validate the query's output schema (resolved by a dry run, nothing is billed):
+        every required column must be present with a compatible type
+        Returns: (is_valid, problems) where each problem names a column or the dry run error
+        """
+        schema = self.get_query_schema(query)
+        if schema is None:
+            return False, [f"dry run failed: {self.dry_run_query(query)['error']}"]
+
+        fields = {field['name'].lower(): field for field in schema}
+        problems = []
+        for column, allowed_types in {**REQUIRED_COLUMN_TYPES, **OPTIONAL_COLUMN_TYPES}.items():
+            field = fields.get(column)
+            if field is None:
+                if column in REQUIRED_COLUMN_TYPES:
+                    problems.append(f"{column} (missing)")
+            elif field['mode'] == "REPEATED" or field['type'] not in allowed_types:
+                field_type = f"ARRAY<{field['type']}>" if field['mode'] == "REPEATED" else field['type']
+                problems.append(f"{column} ({field_type}, expected {' or '.join(allowed_types)})")
+
+        return len(problems) == 0, problems
+
+    def get_query_schema(self, query: str) -> Optional[List[Dict]]:
+        """
+        Output schema of a query as [{'name', 'type', 'mode'}], from the schema cache
+        or a dry run; None if the dry run fails
+        """
+        key = hashlib.sha256(QueryResultCache.normalize_query(query).encode("utf-8")).hexdigest()
+        cached = self.schema_cache.get(key)
+        if cached is not None:
+            return json.loads(cached)
+
+        estimate = self.dry_run_query(query)
+        if estimate['error']:
+            return None
+        self.schema_cache.set(key, json.dumps(estimate['schema']))
+        return estimate['schema']
 
     def get_credentials(self):
-        """Function to get BigQuery credentials"""
+        """Function to get BigQuery credentials (loaded once per process, refreshed in the background)"""
         try:
-            credentials = service_account.Credentials.from_service_account_info(
-                st.secrets["service_account"]
-            )
-            st.success("✅ Successfully loaded credentials from Streamlit secrets")
-        except (KeyError, FileNotFoundError):
-            try:
-                credentials = service_account.Credentials.from_service_account_file(
-                    'service_account.json'
-                )
-                st.success("✅ Successfully loaded service_account.json for BigQuery credentials")
-            except FileNotFoundError:
-                st.error("❌ No credentials found for BigQuery access")
-                return None
-        return credentials
+            refresher = get_credentials_refresher()
+        except FileNotFoundError:
+            st.error("❌ No credentials found for BigQuery access")
+            return None
+
+        st.success(f"✅ Using BigQuery credentials from {refresher.source}")
+        if refresher.last_error is not None:
+            st.warning(f"⚠️ Last background token refresh failed: {refresher.last_error}")
+        return refresher.credentials
 
     def _get_bigquery_client(self):
-        """Get BigQuery client with service account credentials"""
+        """Get the shared BigQuery client with service account credentials"""
         st.info("🔐 Attempting to initialize BigQuery client")
 
         credentials = self.get_credentials()
@@ -148,8 +1319,7 @@ class FlashSalePostGenerator:
             return None
 
         try:
-            # Create a BigQuery client using the credentials
-            client = bigquery.Client(credentials=credentials)
+            client = get_bigquery_client()
             st.success("✅ BigQuery client initialized successfully")
             return client
         except Exception as e:
@@ -166,67 +1336,504 @@ class FlashSalePostGenerator:
             st.error("❌ No BigQuery client available")
             return []
 
-        # Use custom query if provided, otherwise use default
-        if custom_query:
-            # Validate the custom query has required columns
-            is_valid, missing_columns = self.validate_query_columns(custom_query)
-            if not is_valid:
-                st.error(f"❌ Custom query is missing required columns: {', '.join(missing_columns)}")
-                st.error("Please ensure your query returns all required columns with exact names.")
-                return []
-            
-            query = custom_query
-            st.info("✅ Using custom query provided by user")
-        else:
-            # Default query
-            query = """
-                    SELECT DISTINCT a.car_name as sf_vehicle_name,
-                    a.vehicle_id as ajans_vehicle_id,
-                    DATE(a.log_date) AS published_at,
-                    b.car_make,
-                    b.car_model,
-                    b.car_year,
-                    b.kilometrage
-    FROM ajans_dealers.wholesale_vehicle_activity_logs a 
-    LEFT JOIN reporting.vehicle_acquisition_to_selling b ON a.car_name = b.car_name
-    WHERE DATE(log_date) = current_date() AND status_before = "created" AND status_after = "published"
-            """
-            st.info("📝 Using default query")
+        query = self._resolve_query(custom_query)
+        if query is None:
+            return []
+
+        cache_key = None
+        if self.query_cache is not None:
+            cache_key = self.query_cache.key(query, self._query_parameters(query))
+            if self.force_refresh:
+                st.info("🔄 Force refresh requested - ignoring cached query results")
+            else:
+                cached_cars = self.query_cache.get(cache_key)
+                self.query_cache_hit = cached_cars is not None
+                if cached_cars is not None:
+                    st.success(f"💾 Using cached query results: {len(cached_cars)} cars "
+                               f"(cache hits {self.query_cache.hits}, misses {self.query_cache.misses})")
+                    return cached_cars
+
+        if not self._check_query_cost(query):
+            return []
 
         try:
             st.info("Executing flash sale cars query")
-            result = self.client.query(query).to_dataframe()
+            query_started = time.perf_counter()
+            query_job = self.client.query(query, job_config=self._job_config(query))
+            cars_table = self._fetch_arrow(query_job) if self.use_storage_api else None
+            result = query_job.to_dataframe(create_bqstorage_client=False) if cars_table is None else None
+            self.timings.record_call("bigquery.query", time.perf_counter() - query_started)
 
-            st.success(f"📊 Found {len(result)} wholesale-to-retail published cars")
+            row_count = cars_table.num_rows if cars_table is not None else len(result)
+            st.success(f"📊 Found {row_count} wholesale-to-retail published cars")
 
-            if result.empty:
+            if row_count == 0:
                 st.warning("⚠️ No wholesale-to-retail published cars found for today")
                 return []
 
             # Convert to list of dictionaries
-            cars = []
-            for _, row in result.iterrows():
-                car_data = {
-                    'sf_vehicle_name': row['sf_vehicle_name'],
-                    'ajans_vehicle_id': row['ajans_vehicle_id'],
-                    'make': row['car_make'] if not pd.isna(row['car_make']) else 'Unknown',
-                    'model': row['car_model'] if not pd.isna(row['car_model']) else 'Unknown',
-                    'year': int(row['car_year']) if not pd.isna(row['car_year']) else 0,
-                    'kilometers': int(row['kilometrage']) if not pd.isna(row['kilometrage']) else 0,
-                    'published_at': row['published_at']
-                }
-                cars.append(car_data)
-                st.info(
-                    f"🚗 {car_data['sf_vehicle_name']} (ID: {car_data['ajans_vehicle_id']}): {car_data['make']} {car_data['model']} {car_data['year']}")
+            if cars_table is not None:
+                cars_table = self._cars_table(cars_table)
+                st.dataframe(cars_table, use_container_width=True, hide_index=True)
+                cars = cars_table.to_pylist()
+            else:
+                cars_frame = self._cars_frame(result)
+                st.dataframe(cars_frame, use_container_width=True, hide_index=True)
+                cars = cars_frame.to_dict('records')
 
             st.success(f"✅ Successfully processed {len(cars)} wholesale-to-retail published cars")
+            if cache_key is not None and len(cars) <= QUERY_CACHE_MAX_ROWS:
+                self.query_cache.set(cache_key, cars)
             return cars
 
         except Exception as e:
             st.error(f"❌ Error getting wholesale-to-retail published cars: {e}")
             return []
 
+    def dry_run_query(self, query: str) -> Dict:
+        """
+        Estimate a query with a BigQuery dry run (free; nothing is executed)
+        Results are reused for the same query and parameters within this generator
+        Returns: {'bytes_processed': int, 'schema': [{'name', 'type', 'mode'}], 'error': str or None}
+        """
+        parameters = self._query_parameters(query)
+        dry_run_key = (query, parameters)
+        if dry_run_key in self._dry_runs:
+            return self._dry_runs[dry_run_key]
+
+        try:
+            dry_run_started = time.perf_counter()
+            job_config = get_query_job_config(parameters, None, dry_run=True)
+            job = self.client.query(query, job_config=job_config)
+            self.timings.record_call("bigquery.dry_run", time.perf_counter() - dry_run_started)
+            estimate = {
+                'bytes_processed': job.total_bytes_processed or 0,
+                'schema': [
+                    {'name': field.name, 'type': field.field_type, 'mode': field.mode}
+                    for field in (job.schema or [])
+                ],
+                'error': None
+            }
+        except Exception as e:
+            estimate = {'bytes_processed': 0, 'schema': [], 'error': str(e)}
+        self._dry_runs[dry_run_key] = estimate
+        return estimate
+
+    def _check_query_cost(self, query: str) -> bool:
+        """
+        Dry-run the query and refuse it if it would scan more than max_bytes_scanned
+        """
+        if self.max_bytes_scanned is None:
+            return True
+
+        estimate = self.dry_run_query(query)
+        if estimate['error']:
+            st.error(f"❌ Query dry run failed: {estimate['error']}")
+            return False
+
+        st.info(f"💰 Query will process {format_bytes(estimate['bytes_processed'])} "
+                f"(limit {format_bytes(self.max_bytes_scanned)})")
+        if estimate['bytes_processed'] > self.max_bytes_scanned:
+            st.error(f"❌ Query rejected: it would scan {format_bytes(estimate['bytes_processed'])}, "
+                     f"over the {format_bytes(self.max_bytes_scanned)} limit. "
+                     f"Check the date filter or raise the limit.")
+            return False
+        return True
+
+    def _job_config(self, query: str) -> Optional[bigquery.QueryJobConfig]:
+        """
+        Job configuration for executing the flash sale query; the byte ceiling is
+        also enforced server-side through maximum_bytes_billed
+        """
+        parameters = self._query_parameters(query)
+        if self.max_bytes_scanned is None and not parameters:
+            return None
+        return get_query_job_config(parameters, self.max_bytes_scanned)
+
+    def _watermark_key(self, query: str) -> str:
+        return hashlib.sha256(QueryResultCache.normalize_query(query).encode("utf-8")).hexdigest()
+
+    def get_watermark(self, query: str) -> Optional[datetime]:
+        """Latest published_ts delivered for this query, or None outside incremental mode"""
+        if self.watermarks is None:
+            return None
+        value = self.watermarks.get(self._watermark_key(query))
+        return datetime.fromisoformat(value) if value else None
+
+    def _query_parameters(self, query: str) -> tuple:
+        """
+        (name, type, value) for each known parameter the query references
+        @watermark is NULL (fetch the whole range) outside incremental mode and
+        before the first successful run
+        """
+        business_date = datetime.now(timezone.utc).date()
+        values = {
+            "start_date": self.start_date or business_date,
+            "end_date": self.end_date or business_date,
+            "status_before": self.status_before,
+            "status_after": self.status_after,
+        }
+        referenced = {name.lower() for name in QUERY_PARAMETER_REFERENCE.findall(query)}
+        return tuple(
+            (name, parameter_type, self.get_watermark(query) if name == "watermark" else values[name])
+            for name, parameter_type in QUERY_PARAMETER_TYPES.items()
+            if name in referenced
+        )
+
+    def _resolve_query(self, custom_query: str = None) -> Optional[str]:
+        """
+        Pick the query to run: the validated custom query, or the default one
+        Returns None if the custom query is missing required columns
+        """
+        # Use custom query if provided, otherwise use default
+        if custom_query:
+            # Validate the custom query has required columns
+            is_valid, problems = self.validate_query_columns(custom_query)
+            if not is_valid:
+                st.error(f"❌ Custom query failed schema validation: {', '.join(problems)}")
+                st.error("Please ensure your query returns all required columns with exact names and compatible types.")
+                return None
+            
+            query = custom_query
+            st.info("✅ Using custom query provided by user")
+        else:
+            query = DEFAULT_QUERY
+            st.info("📝 Using default query")
+
+        if self.pushdown_filters:
+            query = PUSHDOWN_QUERY_TEMPLATE.format(query=query.strip().rstrip(";"))
+            st.info("🧹 Filtering unpostable cars and duplicate vehicles in BigQuery")
+
+        if self.watermarks is not None:
+            if not WATERMARK_PARAMETER.search(query):
+                st.warning("⚠️ Incremental mode needs a @watermark filter in the query - fetching all matching cars")
+            else:
+                watermark = self.get_watermark(query)
+                if watermark is None:
+                    st.info("📈 Incremental mode: no watermark yet - fetching all of today's cars")
+                else:
+                    st.info(f"📈 Incremental mode: fetching cars published after {watermark.isoformat()}")
+
+        self._last_query = query
+        return query
+
+    def _query_pages(self, query: str, page_size: int) -> Iterator[pd.DataFrame]:
+        """
+        Start the query and return an iterator over its result pages as DataFrames
+        Pages are downloaded lazily, one per next() call
+        """
+        rows = self.client.query(query, job_config=self._job_config(query)).result(page_size=page_size)
+        return rows.to_dataframe_iterable()
+
+    def _fetch_arrow(self, query_job: bigquery.QueryJob) -> Optional[pa.Table]:
+        """
+        Download query results as Arrow record batches through the Storage Read API
+        Returns None when the storage API can't be used, so the caller falls back to REST
+        """
+        if bigquery_storage is None:
+            st.warning("⚠️ google-cloud-bigquery-storage is not installed - downloading results over REST")
+            return None
+
+        try:
+            table = query_job.result().to_arrow(
+                bqstorage_client=get_bigquery_storage_client(),
+                create_bqstorage_client=False
+            )
+            st.info(f"🏹 Downloaded {table.num_rows} rows as Arrow via the BigQuery Storage Read API")
+            return table
+        except Exception as e:
+            st.warning(f"⚠️ BigQuery Storage Read API unavailable ({e}) - downloading results over REST")
+            return None
+
+    @staticmethod
+    def _cars_table(result: pa.Table) -> pa.Table:
+        """
+        Arrow counterpart of _cars_frame: map result columns to car record fields
+        without leaving Arrow
+        """
+        def as_int(column: pa.ChunkedArray) -> pa.ChunkedArray:
+            # Like pd.to_numeric(errors='coerce'): anything that isn't a number becomes 0
+            if pa.types.is_string(column.type) or pa.types.is_large_string(column.type):
+                column = pc.utf8_trim_whitespace(column)
+                is_number = pc.match_substring_regex(column, r"^[+-]?(\d+\.?\d*|\.\d+)([eE][+-]?\d+)?$")
+                column = pc.if_else(is_number, column, None)
+            if not pa.types.is_integer(column.type):
+                column = pc.cast(column, pa.float64())
+                column = pc.if_else(pc.is_finite(column), column, None)
+            return pc.fill_null(pc.cast(column, pa.int64(), safe=False), 0)
+
+        cars = pa.table({
+            'sf_vehicle_name': result['sf_vehicle_name'],
+            'ajans_vehicle_id': result['ajans_vehicle_id'],
+            'make': pc.fill_null(pc.cast(result['car_make'], pa.string()), 'Unknown'),
+            'model': pc.fill_null(pc.cast(result['car_model'], pa.string()), 'Unknown'),
+            'year': as_int(result['car_year']),
+            'kilometers': as_int(result['kilometrage']),
+            'published_at': result['published_at']
+        })
+        if 'published_ts' in result.column_names:
+            cars = cars.append_column('published_ts', result['published_ts'])
+        return cars
+
+    @staticmethod
+    def _cars_frame(result: pd.DataFrame) -> pd.DataFrame:
+        """
+        Map query result columns to car record fields as whole-column operations
+        Missing make/model become 'Unknown', missing year/kilometers become 0
+        """
+        cars = pd.DataFrame({
+            'sf_vehicle_name': result['sf_vehicle_name'],
+            'ajans_vehicle_id': result['ajans_vehicle_id'],
+            'make': result['car_make'].astype(object).where(result['car_make'].notna(), 'Unknown'),
+            'model': result['car_model'].astype(object).where(result['car_model'].notna(), 'Unknown'),
+            'year': pd.to_numeric(result['car_year'], errors='coerce').fillna(0).astype('int64'),
+            'kilometers': pd.to_numeric(result['kilometrage'], errors='coerce').fillna(0).astype('int64'),
+            'published_at': result['published_at']
+        })
+        if 'published_ts' in result.columns:
+            cars['published_ts'] = result['published_ts']
+        return cars
+
+    def _run(self, coro):
+        """
+        Run a coroutine to completion on the shared HTTP runtime
+        """
+        return self.http_runtime.run(coro)
+
+    def _limiter(self, url: str) -> Optional[TokenBucket]:
+        """Rate limiter for url: this generator's own for the tracking link API if it has a link rate limit, else the shared one"""
+        if self.link_rate_limit is not None and url in (TRACKING_LINK_ENDPOINT, TRACKING_LINK_BULK_ENDPOINT):
+            return self.link_limiter
+        return self.http_runtime.limiter(url)
+
+    @staticmethod
+    async def _to_thread(func, *args):
+        """
+        Run a blocking call (BigQuery) in a worker thread so it doesn't hold up the
+        event loop other sessions' runs share; st.* calls render in this run's session
+        """
+        ctx = get_script_run_ctx(suppress_warning=True)
+
+        def call():
+            thread = threading.current_thread()
+            if ctx is not None:
+                add_script_run_ctx(thread, ctx)
+            try:
+                return func(*args)
+            finally:
+                setattr(thread, SCRIPT_RUN_CONTEXT_ATTR_NAME, None)
+
+        return await asyncio.to_thread(call)
+
+    def _start_run(self) -> bool:
+        """
+        Start timing a run, and its budget clock if a budget is set, unless a run
+        is already in progress
+        Returns: True if this call started the run (and must finish it with _end_run)
+        """
+        if self._run_active:
+            return False
+        self._run_active = True
+        self._run_started = time.perf_counter()
+        self.timings = RunTimings()
+        if self.run_budget is not None:
+            self._run_deadline = time.monotonic() + self.run_budget
+            self._request_deadline = self._run_deadline
+        return True
+
+    def _end_run(self):
+        self.timings.stages["total"] = time.perf_counter() - self._run_started
+        self._run_active = False
+        self._run_deadline = None
+        self._request_deadline = None
+
+    def _remaining_budget(self) -> Optional[float]:
+        """Seconds left before the current request deadline, or None without a budget"""
+        if self._request_deadline is None:
+            return None
+        return self._request_deadline - time.monotonic()
+
+    async def _apost_with_retry(self, url: str, breaker: Optional[CircuitBreaker] = None,
+                                max_retries: int = 0, sent: Optional[SendSignal] = None,
+                                latency: Optional[LatencyTracker] = None, **kwargs) -> httpx.Response:
+        """
+        POST to url, retrying transport errors and retryable statuses with
+        exponential backoff and full jitter
+
+        sent is set once a rate-limit token is acquired and the request goes out;
+        latency records each attempt's duration, excluding time waiting for a token
+
+        Returns the last response (which may still be an error status) or raises
+        the last transport error; raises CircuitOpenError without sending when
+        the breaker is open
+        """
+        limiter = self._limiter(url)
+        label = ENDPOINT_LABELS.get(url, httpx.URL(url).host)
+        attempt = 0
+        while True:
+            if breaker is not None and not breaker.allow_request():
+                raise CircuitOpenError(f"circuit breaker open for {httpx.URL(url).host}")
+
+            if limiter is not None:
+                await limiter.acquire()
+
+            # Never let a single attempt outlive the run budget
+            request_kwargs = kwargs
+            remaining = self._remaining_budget()
+            if remaining is not None:
+                if remaining <= 0:
+                    raise RunBudgetExceeded(f"run budget exhausted before request to {httpx.URL(url).path}")
+                request_kwargs = dict(kwargs, timeout=min(kwargs.get('timeout', HTTP_TIMEOUT), remaining))
+
+            if sent is not None:
+                sent.set()
+            response, error = None, None
+            attempt_started = time.perf_counter()
+            try:
+                response = await self.http_runtime.client(url).post(url, **request_kwargs)
+            except httpx.TransportError as e:
+                error = e
+            finally:
+                self.timings.record_call(label, time.perf_counter() - attempt_started)
+            # Cancelled attempts (the losing side of a hedge) never get here, so they don't skew the sample
+            if latency is not None:
+                latency.record(time.perf_counter() - attempt_started)
+
+            retry_after = None
+            if response is not None:
+                retry_after = self._retry_after_seconds(response.headers.get("Retry-After", ""))
+                if limiter is not None:
+                    if response.status_code == 429:
+                        # The whole host waits out the server's full Retry-After
+                        limiter.throttle(retry_after)
+                    elif response.status_code < 400:
+                        limiter.recover()
+
+            if breaker is not None:
+                # A 429 is back-pressure from a healthy server and is left to the rate limiter;
+                # only transport errors and 5xx responses count against the breaker
+                if response is None or (response.status_code in RETRYABLE_STATUSES and response.status_code != 429):
+                    breaker.record_failure()
+                else:
+                    breaker.record_success()
+            if response is not None and response.status_code not in RETRYABLE_STATUSES:
+                return response
+
+            if attempt >= max_retries:
+                if response is not None:
+                    return response
+                raise error
+
+            delay = random.uniform(0, min(RETRY_BACKOFF_MAX, RETRY_BACKOFF_BASE * 2 ** attempt))
+            if retry_after:
+                delay = max(delay, min(retry_after, RETRY_BACKOFF_MAX))
+            # A paused limiter holds the next attempt until the full Retry-After has passed
+            retry_in = max(delay, retry_after) if retry_after and limiter is not None else delay
+            remaining = self._remaining_budget()
+            if remaining is not None and retry_in >= remaining:
+                # No time left for another attempt
+                if response is not None:
+                    return response
+                raise error
+            reason = f"status {response.status_code}" if response is not None else type(error).__name__
+            st.warning(f"🔁 Retrying {httpx.URL(url).path} after {reason} in {retry_in:.1f}s "
+                       f"(attempt {attempt + 2}/{max_retries + 1})")
+            self.retries[label] = self.retries.get(label, 0) + 1
+            attempt += 1
+            await asyncio.sleep(delay)
+
+    def _hedge_delay(self) -> float:
+        """Seconds to wait before hedging a tracking link request"""
+        if len(self.link_attempt_latency) < HEDGE_MIN_SAMPLES:
+            return HEDGE_DEFAULT_DELAY
+        return self.link_attempt_latency.percentile(HEDGE_PERCENTILE)
+
+    async def _apost_hedged(self, url: str, **kwargs) -> httpx.Response:
+        """
+        POST via _apost_with_retry, sending a duplicate request if the first one is
+        slower than the hedge delay; the first 200 response wins and the other
+        request is cancelled
+
+        The hedge delay is counted from when the first request is sent, so time spent
+        waiting for a rate-limit token doesn't trigger a hedge
+        """
+        sent = kwargs.pop('sent', None) or SendSignal()
+        primary = asyncio.create_task(self._apost_with_retry(url, sent=sent, **kwargs))
+        sent_wait = asyncio.create_task(sent.wait())
+        tasks = [primary, sent_wait]
+        try:
+            await asyncio.wait([primary, sent_wait], return_when=asyncio.FIRST_COMPLETED)
+            if not primary.done():
+                await asyncio.wait([primary], timeout=self._hedge_delay())
+            if primary.done():
+                return primary.result()
+
+            self.link_hedges += 1
+            hedge = asyncio.create_task(self._apost_with_retry(url, **kwargs))
+            tasks.append(hedge)
+            pending = {primary, hedge}
+            while pending:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    if task.exception() is None and task.result().status_code == 200:
+                        return task.result()
+            # Neither request succeeded: report the original request's outcome
+            return primary.result()
+        finally:
+            for task in tasks:
+                if not task.done():
+                    task.cancel()
+
     def create_tracking_link(self, vehicle_name: str, ajans_vehicle_id: str) -> str:
+        """
+        Create a tracking link for the car using nonito.xyz API
+        Synchronous wrapper around acreate_tracking_link
+        """
+        return self._run(self.acreate_tracking_link(vehicle_name, ajans_vehicle_id))
+
+    @staticmethod
+    def _tracking_link_payload(vehicle_name: str, ajans_vehicle_id: str) -> Dict:
+        """
+        Build the nonito.xyz request payload for a car
+        """
+        # Generate link name in format: {flashsale-date-cname}
+        current_date = datetime.now().strftime("%Y%m%d")
+        link_name = f"flashsale-{current_date}-{vehicle_name}"
+
+        return {
+            "link_name": link_name,
+            "final_link": f"sylndr://car-details/{ajans_vehicle_id}",
+            "sender_id": TRACKING_LINK_SENDER_ID,
+            "domain": TRACKING_LINK_DOMAIN,
+            "deeplink": True
+        }
+
+    @staticmethod
+    def _retry_after_seconds(header: str) -> Optional[float]:
+        """
+        Seconds to wait from a Retry-After header, given either as delay-seconds or as
+        an HTTP-date; None if the header is missing or malformed
+        """
+        header = header.strip()
+        if header.isdigit():
+            return float(header)
+        try:
+            retry_at = email.utils.parsedate_to_datetime(header)
+        except (TypeError, ValueError):
+            return None
+        if retry_at.tzinfo is None:
+            retry_at = retry_at.replace(tzinfo=timezone.utc)
+        return max(0.0, (retry_at - datetime.now(timezone.utc)).total_seconds())
+
+    @staticmethod
+    def _extract_tracking_link(response_data: Dict) -> Optional[str]:
+        """
+        Pull the tracking link out of a nonito.xyz response object
+        """
+        # Assuming the API returns the tracking link in the response
+        return response_data.get('tracking_link') or response_data.get('link') or response_data.get('url')
+
+    async def acreate_tracking_link(self, vehicle_name: str, ajans_vehicle_id: str, check_cache: bool = True) -> str:
         """
         Create a tracking link for the car using nonito.xyz API
         Based on the abandon car flow implementation
@@ -234,54 +1841,161 @@ class FlashSalePostGenerator:
         Args:
             vehicle_name: The vehicle name (sf_vehicle_name)
             ajans_vehicle_id: The ajans vehicle ID for the deeplink
+            check_cache: Look the link up in the link cache before calling the API
 
         Returns:
             Tracking link URL or fallback URL if creation fails
         """
         st.info(f"🔗 Creating tracking link for vehicle {vehicle_name}")
 
-        # Generate link name in format: {flashsale-date-cname}
-        current_date = datetime.now().strftime("%Y%m%d")
-        link_name = f"flashsale-{current_date}-{vehicle_name}"
+        payload = self._tracking_link_payload(vehicle_name, ajans_vehicle_id)
 
-        # API endpoint and payload
-        url = "https://hi.nonito.xyz/create_tracking_link"
-        payload = {
-            "link_name": link_name,
-            "final_link": f"sylndr://car-details/{ajans_vehicle_id}",
-            "sender_id": "6eb7c941-13b9-4eb3-8402-5310e2bc0f8e",
-            "domain": "elajans.link",
-            "deeplink": True
-        }
+        cache_key = f"{payload['link_name']}|{payload['final_link']}"
+        if self.link_cache is not None and check_cache:
+            cached_link = self.link_cache.get(cache_key)
+            if cached_link:
+                self.link_cache_hits += 1
+                st.success(f"💾 Reusing cached tracking link for {vehicle_name}: {cached_link}")
+                return cached_link
+            self.link_cache_misses += 1
 
         try:
             st.info(f"🔗 Making tracking link request: {json.dumps(payload, indent=2)}")
-            response = requests.post(url, json=payload, timeout=30)
+            post = self._apost_hedged if self.hedge_links else self._apost_with_retry
+            self.link_requests += 1
+            # Per-attempt samples set the hedge delay; the reported latency is per link,
+            # from the first send to the response used (including retries and hedges)
+            sent = SendSignal()
+            try:
+                response = await post(
+                    TRACKING_LINK_ENDPOINT,
+                    breaker=self.link_breaker,
+                    max_retries=self.link_max_retries,
+                    sent=sent,
+                    latency=self.link_attempt_latency,
+                    json=payload,
+                    timeout=TRACKING_LINK_TIMEOUT
+                )
+            finally:
+                if sent.sent_at is not None:
+                    self.link_latency.record(time.perf_counter() - sent.sent_at)
 
             st.info(f"🔗 Tracking link API Response - Status Code: {response.status_code}")
             st.info(f"🔗 Tracking link API Response Body: {response.text}")
 
             if response.status_code == 200:
-                response_data = response.json()
-                # Assuming the API returns the tracking link in the response
-                tracking_link = response_data.get('tracking_link') or response_data.get('link') or response_data.get(
-                    'url')
+                tracking_link = self._extract_tracking_link(response.json())
                 if tracking_link:
                     st.success(f"✅ Tracking link created successfully: {tracking_link}")
+                    if self.link_cache is not None:
+                        self.link_cache.set(cache_key, tracking_link)
                     return tracking_link
                 else:
                     st.warning(f"⚠️ Tracking link API returned success but no link found in response")
-                    return "elajans.link"
+                    return FALLBACK_TRACKING_LINK
             else:
                 st.error(f"❌ Tracking link creation failed with status {response.status_code}: {response.text}")
-                return "elajans.link"
-
-        except requests.exceptions.RequestException as e:
+                return FALLBACK_TRACKING_LINK
+
+        except CircuitOpenError:
+            st.warning(f"⚡ Tracking link API unavailable, using fallback link for {vehicle_name}")
+            return FALLBACK_TRACKING_LINK
+        except RunBudgetExceeded:
+            st.warning(f"⏱️ Run budget exhausted, using fallback link for {vehicle_name}")
+            return FALLBACK_TRACKING_LINK
+        except httpx.HTTPError as e:
             st.error(f"❌ Tracking link request failed with exception: {e}")
-            return "elajans.link"
+            return FALLBACK_TRACKING_LINK
         except Exception as e:
             st.error(f"❌ Unexpected error creating tracking link: {e}")
-            return "elajans.link"
+            return FALLBACK_TRACKING_LINK
+
+    async def acreate_tracking_links_bulk(self, cars: List[Dict]) -> Dict[str, str]:
+        """
+        Create tracking links for many cars using the bulk nonito.xyz endpoint
+
+        Links are sent in chunks of link_batch_size and matched back to cars by
+        link_name. Cars missing from the result (bulk endpoint unavailable, chunk
+        failed, or link absent from the response) should fall back to
+        acreate_tracking_link.
+
+        Returns:
+            Mapping of link_name to tracking link for the links that were resolved
+        """
+        resolved = {}
+        pending = []
+
+        for car_data in cars:
+            payload = self._tracking_link_payload(car_data['sf_vehicle_name'], car_data['ajans_vehicle_id'])
+            cache_key = f"{payload['link_name']}|{payload['final_link']}"
+            if self.link_cache is not None:
+                cached_link = self.link_cache.get(cache_key)
+                if cached_link:
+                    self.link_cache_hits += 1
+                    resolved[payload['link_name']] = cached_link
+                    continue
+                self.link_cache_misses += 1
+            pending.append(payload)
+
+        if not pending:
+            return resolved
+
+        chunks = [pending[i:i + self.link_batch_size] for i in range(0, len(pending), self.link_batch_size)]
+        st.info(f"📦 Creating {len(pending)} tracking links in {len(chunks)} bulk requests")
+
+        bulk_available = True
+        semaphore = asyncio.Semaphore(self.link_concurrency)
+
+        async def send_chunk(chunk: List[Dict]):
+            nonlocal bulk_available
+            async with semaphore:
+                if not bulk_available:
+                    return
+                try:
+                    response = await self._apost_with_retry(
+                        TRACKING_LINK_BULK_ENDPOINT,
+                        breaker=self.link_breaker,
+                        max_retries=self.link_max_retries,
+                        json={"links": chunk}
+                    )
+                except (CircuitOpenError, RunBudgetExceeded):
+                    return
+                except httpx.HTTPError as e:
+                    st.error(f"❌ Bulk tracking link request failed with exception: {e}")
+                    return
+
+                if response.status_code in BULK_UNAVAILABLE_STATUSES:
+                    bulk_available = False
+                    st.warning(f"⚠️ Bulk tracking link endpoint unavailable (status {response.status_code})")
+                    return
+                if response.status_code != 200:
+                    st.error(f"❌ Bulk tracking link request failed with status {response.status_code}: {response.text}")
+                    return
+
+                try:
+                    response_data = response.json()
+                    items = response_data.get('links', []) if isinstance(response_data, dict) else response_data
+                    for item in items:
+                        tracking_link = self._extract_tracking_link(item)
+                        if item.get('link_name') and tracking_link:
+                            resolved[item['link_name']] = tracking_link
+                except (ValueError, AttributeError, TypeError) as e:
+                    st.error(f"❌ Unexpected bulk tracking link response: {e}")
+                    return
+
+                if self.link_cache is not None:
+                    for payload in chunk:
+                        if payload['link_name'] in resolved:
+                            self.link_cache.set(f"{payload['link_name']}|{payload['final_link']}",
+                                                resolved[payload['link_name']])
+
+        await asyncio.gather(*(send_chunk(chunk) for chunk in chunks))
+
+        unresolved = sum(1 for payload in pending if payload['link_name'] not in resolved)
+        st.info(f"📦 Bulk tracking links resolved: {len(pending) - unresolved}/{len(pending)}")
+        if unresolved:
+            st.warning(f"⚠️ {unresolved} tracking links will be created one by one")
+        return resolved
 
     def generate_post_content(self, car_data: Dict, tracking_link: str) -> str:
         """
@@ -306,140 +2020,577 @@ class FlashSalePostGenerator:
             # Return a basic fallback post
             return f"🔥 Flash Sale! {car_data['make']} {car_data['model']} {car_data['year']} - {tracking_link}"
 
-    def generate_posts(self, custom_query: str = None) -> List[Dict]:
+    async def _aprocess_car(self, car_data: Dict, semaphore: asyncio.Semaphore,
+                            bulk_links: Optional[Dict[str, str]] = None) -> Optional[Dict]:
         """
-        Main function to generate posts for all flash sale cars
+        Create the tracking link and post for a single car
+        bulk_links holds links already created in bulk, keyed by link_name
+        Returns: post data, or None if the car was skipped or failed
         """
-        st.info("🚀 Starting flash sale posts generation...")
+        vehicle_name = car_data['sf_vehicle_name']
 
-        # Get flash sale cars
-        flash_sale_cars = self.get_flash_sale_cars(custom_query)
+        try:
+            st.info(
+                f"🚗 Processing {vehicle_name} (ID: {car_data['ajans_vehicle_id']}): {car_data['make']} {car_data['model']} {car_data['year']}")
 
-        if not flash_sale_cars:
-            st.info("ℹ️ No flash sale cars found. No posts to generate.")
-            return []
+            # Skip cars with unknown make or model
+            if car_data['make'] == 'Unknown' or car_data['model'] == 'Unknown':
+                st.warning(f"⏭️ Skipping {vehicle_name}: Unknown make or model")
+                return None
 
-        st.info(f"📱 Generating posts for {len(flash_sale_cars)} flash sale cars")
+            # Use ajans_vehicle_id as the listing ID for deeplink
+            ajans_vehicle_id = car_data['ajans_vehicle_id']
+            if not ajans_vehicle_id:
+                st.warning(f"⚠️ No ajans_vehicle_id found for {vehicle_name}, skipping")
+                return None
 
-        posts = []
-        successful_posts = 0
-        failed_posts = 0
+            # Create tracking link using ajans_vehicle_id
+            if bulk_links is not None:
+                link_name = self._tracking_link_payload(vehicle_name, ajans_vehicle_id)['link_name']
+                tracking_link = bulk_links.get(link_name)
+                if tracking_link is None:
+                    # Bulk creation already consulted the cache for this car
+                    async with semaphore:
+                        tracking_link = await self.acreate_tracking_link(vehicle_name, ajans_vehicle_id,
+                                                                         check_cache=False)
+            else:
+                async with semaphore:
+                    tracking_link = await self.acreate_tracking_link(vehicle_name, ajans_vehicle_id)
+
+            # Generate post content
+            post_content = self.generate_post_content(car_data, tracking_link)
+
+            post_data = {
+                "car_id": vehicle_name,
+                "ajans_vehicle_id": ajans_vehicle_id,
+                "make": car_data['make'],
+                "model": car_data['model'],
+                "year": car_data['year'],
+                "kilometers": car_data['kilometers'],
+                "tracking_link": tracking_link,
+                "post_content": post_content,
+                "generated_at": datetime.now().isoformat(),
+                "idempotency_key": self.idempotency_key(car_data)
+            }
+
+            st.success(f"✅ Successfully generated post for {vehicle_name}")
+            return post_data
+
+        except Exception as e:
+            st.error(f"❌ Error processing {vehicle_name}: {e}")
+            return None
 
-        for car_data in flash_sale_cars:
-            vehicle_name = car_data['sf_vehicle_name']
+    def generate_posts(self, custom_query: str = None) -> List[Dict]:
+        """
+        Main function to generate posts for all flash sale cars
+        Synchronous wrapper around agenerate_posts
+        """
+        return self._run(self.agenerate_posts(custom_query))
 
+    async def agenerate_posts(self, custom_query: str = None) -> List[Dict]:
+        """
+        Generate posts for all flash sale cars, creating tracking links concurrently
+        """
+        started_run = self._start_run()
+        try:
+            return await self._agenerate_posts(custom_query)
+        finally:
+            if started_run:
+                self._end_run()
+
+    @staticmethod
+    def idempotency_key(car_data: Dict) -> str:
+        """
+        Deterministic key of a car's post for its business date: the car's published_at,
+        or today in UTC when it has none, so the key doesn't depend on the server's
+        timezone or on which side of midnight the run happens
+        """
+        published_at = car_data.get('published_at')
+        if published_at is None or pd.isna(published_at):
+            business_date = datetime.now(timezone.utc).date()
+        else:
+            business_date = pd.Timestamp(published_at).date()
+        return f"flashsale-{business_date.strftime('%Y%m%d')}-{car_data['ajans_vehicle_id']}"
+
+    def _drop_posted(self, cars: List[Dict]) -> List[Dict]:
+        """Leave out cars whose post for today was already delivered or is queued in the outbox"""
+        if self.posted_keys is None:
+            return cars
+        new_cars = [car_data for car_data in cars if self.posted_keys.get(self.idempotency_key(car_data)) is None]
+        skipped = len(cars) - len(new_cars)
+        if skipped:
+            self.skipped_posted += skipped
+            st.info(f"⏭️ Skipping {skipped} cars already posted today")
+        return new_cars
+
+    def _mark_posted(self, posts: List[Dict], state: str):
+        """Record posts' idempotency keys as 'queued' or 'delivered'"""
+        if self.posted_keys is None:
+            return
+        for post in posts:
+            if post.get('idempotency_key'):
+                self.posted_keys.set(post['idempotency_key'], state)
+
+    @staticmethod
+    def _is_postable(car_data: Dict) -> bool:
+        """Whether a car has everything needed for a post (known make/model and an ajans ID)"""
+        return car_data['make'] != 'Unknown' and car_data['model'] != 'Unknown' and bool(car_data['ajans_vehicle_id'])
+
+    async def _astream_cars(self, query: str, semaphore: asyncio.Semaphore, cars: List[Dict],
+                            tasks: List[asyncio.Task]):
+        """
+        Download query results page by page and start link/post tasks for each
+        page as soon as it arrives; the next page downloads while the current
+        one is processed. Appends to cars and tasks in query order
+        """
+        query_started = time.perf_counter()
+        with self.timings.stage("bigquery_stream"):
+            pages = await self._to_thread(self._query_pages, query, self.page_size)
+            next_page = asyncio.create_task(self._to_thread(next, pages, None))
+            page_number = 0
             try:
-                st.info(
-                    f"🚗 Processing {vehicle_name} (ID: {car_data['ajans_vehicle_id']}): {car_data['make']} {car_data['model']} {car_data['year']}")
+                while True:
+                    frame = await next_page
+                    if frame is None:
+                        break
+                    next_page = asyncio.create_task(self._to_thread(next, pages, None))
+
+                    page_number += 1
+                    page_cars = self._drop_posted(self._cars_frame(frame).to_dict('records'))
+                    del frame
+                    cars.extend(page_cars)
+                    st.info(f"📄 Page {page_number}: {len(page_cars)} cars ({len(cars)} so far)")
+
+                    bulk_links = None
+                    if self.bulk_links:
+                        bulk_links = await self.acreate_tracking_links_bulk(
+                            [car_data for car_data in page_cars if self._is_postable(car_data)]
+                        )
+                    tasks.extend(
+                        asyncio.create_task(self._aprocess_car(car_data, semaphore, bulk_links))
+                        for car_data in page_cars
+                    )
+
+                    # Back-pressure: don't run ahead of link creation by more than a few pages
+                    in_flight = [task for task in tasks if not task.done()]
+                    while len(in_flight) >= self.page_size * STREAM_MAX_PENDING_PAGES:
+                        await asyncio.wait(in_flight, return_when=asyncio.FIRST_COMPLETED)
+                        in_flight = [task for task in in_flight if not task.done()]
+            finally:
+                next_page.cancel()
+                self.timings.record_call("bigquery.query", time.perf_counter() - query_started)
+
+        st.success(f"📊 Streamed {len(cars)} wholesale-to-retail published cars in {page_number} pages")
+
+    async def _agenerate_posts(self, custom_query: str = None) -> List[Dict]:
+        st.info("🚀 Starting flash sale posts generation...")
 
-                # Skip cars with unknown make or model
-                if car_data['make'] == 'Unknown' or car_data['model'] == 'Unknown':
-                    st.warning(f"⏭️ Skipping {vehicle_name}: Unknown make or model")
-                    failed_posts += 1
-                    continue
+        self.link_cache_hits = 0
+        self.link_cache_misses = 0
+        self.retries = {}
+        self.skipped_posted = 0
+        self.link_latency = LatencyTracker()
+        self.link_attempt_latency = LatencyTracker()
+        self.link_requests = 0
+        self.link_hedges = 0
+        self._pending_watermark = None
+        # Fresh breaker per run: once it opens, the rest of this run fails fast
+        self.link_breaker = CircuitBreaker()
+        link_limiter = self._limiter(TRACKING_LINK_ENDPOINT)
+        if link_limiter is not None:
+            link_limiter.max_waiting = 0
+
+        # Link creation stops early enough to leave time for webhook delivery
+        link_deadline = None
+        if self._run_deadline is not None:
+            link_deadline = self._run_deadline - min(
+                RUN_BUDGET_DELIVERY_RESERVE, RUN_BUDGET_DELIVERY_RESERVE_FRACTION * self.run_budget
+            )
+            self._request_deadline = link_deadline
+
+        # One task per car; results are read back in input order, so posts keep the query order
+        semaphore = asyncio.Semaphore(self.link_concurrency)
+        flash_sale_cars: List[Dict] = []
+        tasks: List[asyncio.Task] = []
+        producer = None
+
+        if self.stream_results:
+            st.info(f"🌊 Streaming query results in pages of {self.page_size} rows")
+            if not self.client:
+                st.error("❌ No BigQuery client available")
+                return []
+            query = await self._to_thread(self._resolve_query, custom_query)
+            if query is None or not await self._to_thread(self._check_query_cost, query):
+                return []
+            producer = asyncio.create_task(self._astream_cars(query, semaphore, flash_sale_cars, tasks))
+        else:
+            # Get flash sale cars
+            with self.timings.stage("bigquery_fetch"):
+                flash_sale_cars = await self._to_thread(self.get_flash_sale_cars, custom_query)
 
-                # Use ajans_vehicle_id as the listing ID for deeplink
-                ajans_vehicle_id = car_data['ajans_vehicle_id']
-                if not ajans_vehicle_id:
-                    st.warning(f"⚠️ No ajans_vehicle_id found for {vehicle_name}, skipping")
-                    failed_posts += 1
-                    continue
+            if not flash_sale_cars:
+                st.info("ℹ️ No flash sale cars found. No posts to generate.")
+                return []
 
-                # Create tracking link using ajans_vehicle_id
-                tracking_link = self.create_tracking_link(vehicle_name, ajans_vehicle_id)
+            flash_sale_cars = self._drop_posted(flash_sale_cars)
+            if not flash_sale_cars:
+                st.info("ℹ️ Every flash sale car was already posted today. No posts to generate.")
+                return []
 
-                # Generate post content
-                post_content = self.generate_post_content(car_data, tracking_link)
+            st.info(f"📱 Generating posts for {len(flash_sale_cars)} flash sale cars")
 
-                # Add to posts list
-                post_data = {
-                    "car_id": vehicle_name,
-                    "ajans_vehicle_id": ajans_vehicle_id,
-                    "make": car_data['make'],
-                    "model": car_data['model'],
-                    "year": car_data['year'],
-                    "kilometers": car_data['kilometers'],
-                    "tracking_link": tracking_link,
-                    "post_content": post_content,
-                    "generated_at": datetime.now().isoformat()
-                }
+            bulk_links = None
+            if self.bulk_links:
+                with self.timings.stage("tracking_links_bulk"):
+                    bulk_links = await self.acreate_tracking_links_bulk(
+                        [car_data for car_data in flash_sale_cars if self._is_postable(car_data)]
+                    )
 
-                posts.append(post_data)
-                successful_posts += 1
+            tasks.extend(
+                asyncio.create_task(self._aprocess_car(car_data, semaphore, bulk_links))
+                for car_data in flash_sale_cars
+            )
 
-                st.success(f"✅ Successfully generated post for {vehicle_name}")
+        st.info(f"⚡ Creating tracking links with up to {self.link_concurrency} concurrent requests")
+
+        def time_left() -> Optional[float]:
+            return None if link_deadline is None else max(0.0, link_deadline - time.monotonic())
+
+        with self.timings.stage("tracking_links_and_posts"):
+            stream_complete = True
+            if producer is not None:
+                await asyncio.wait([producer], timeout=time_left())
+                if not producer.done():
+                    producer.cancel()
+                    await asyncio.gather(producer, return_exceptions=True)
+                    stream_complete = False
+                elif producer.exception() is not None:
+                    st.error(f"❌ Error streaming wholesale-to-retail published cars: {producer.exception()}")
+                    stream_complete = False
+
+            done, pending = set(), set()
+            if tasks:
+                done, pending = await asyncio.wait(tasks, timeout=time_left())
+
+            cancelled_posts = len(pending)
+            if pending:
+                st.warning(f"⏱️ Run budget of {self.run_budget:.0f}s reached - cancelling {len(pending)} unfinished cars")
+                for task in pending:
+                    task.cancel()
+                await asyncio.gather(*pending, return_exceptions=True)
+        if self._run_deadline is not None:
+            self._request_deadline = self._run_deadline
 
-            except Exception as e:
-                st.error(f"❌ Error processing {vehicle_name}: {e}")
-                failed_posts += 1
-                continue
+        if not flash_sale_cars:
+            st.info("ℹ️ No flash sale cars found. No posts to generate.")
+            return []
+
+        results = [task.result() if task in done else None for task in tasks]
+        posts = [post for post in results if post is not None]
+        successful_posts = len(posts)
+        failed_posts = len(results) - successful_posts - cancelled_posts
+
+        # Incremental mode: the watermark only advances once the webhook accepts these posts
+        if self.watermarks is not None and self._last_query and WATERMARK_PARAMETER.search(self._last_query):
+            if not stream_complete:
+                st.warning("⚠️ Query results were not fully streamed - watermark not advanced")
+            elif 'published_ts' not in flash_sale_cars[0]:
+                st.warning("⚠️ Query has no published_ts column - watermark not advanced")
+            else:
+                self._pending_watermark = self._next_watermark(flash_sale_cars, results)
 
         # Summary
         st.info("📊 FLASH SALE POSTS GENERATION SUMMARY")
         st.info(f"🚗 Total flash sale cars found: {len(flash_sale_cars)}")
         st.info(f"✅ Posts generated successfully: {successful_posts}")
         st.info(f"❌ Posts failed: {failed_posts}")
+        if self.skipped_posted:
+            st.info(f"⏭️ Cars skipped as already posted today: {self.skipped_posted}")
+        if self.query_cache_hit is not None:
+            st.info(f"💾 Query results: {'served from cache' if self.query_cache_hit else 'fetched from BigQuery'}")
+        if cancelled_posts:
+            st.info(f"⏱️ Posts cancelled by run budget: {cancelled_posts}")
+        if self.link_cache is not None:
+            st.info(f"💾 Tracking link cache: {self.link_cache_hits} hits, {self.link_cache_misses} misses")
+            self.link_cache.prune()
+        link_retries = sum(self.retries.get(ENDPOINT_LABELS[url], 0)
+                           for url in (TRACKING_LINK_ENDPOINT, TRACKING_LINK_BULK_ENDPOINT))
+        st.info(f"🔁 Tracking link retries: {link_retries}")
+        if len(self.link_latency):
+            p50, p95, p99 = (self.link_latency.percentile(p) for p in (50, 95, 99))
+            st.info(f"⏱️ Tracking link latency: p50 {p50 * 1000:.0f} ms, p95 {p95 * 1000:.0f} ms, "
+                    f"p99 {p99 * 1000:.0f} ms")
+        if self.hedge_links and self.link_requests:
+            st.info(f"🏁 Hedged requests: {self.link_hedges}/{self.link_requests} "
+                    f"({self.link_hedges / self.link_requests:.1%})")
+        if link_limiter is not None:
+            st.info(f"🚦 Tracking link rate limit: {link_limiter.rate:.1f}/{link_limiter.max_rate:.1f} req/s, "
+                    f"peak queue depth {link_limiter.max_waiting}, {link_limiter.waiting} waiting now")
+        if self.link_breaker.state != "closed":
+            st.warning(f"⚡ Tracking link circuit breaker is {self.link_breaker.state.replace('_', '-')} - "
+                       f"some posts use the fallback link")
         st.success("🏁 Flash sale posts generation completed!")
 
         return posts
 
+    def _next_watermark(self, cars: List[Dict], results: List[Optional[Dict]]) -> Optional[datetime]:
+        """
+        Highest published_ts that can be recorded without skipping a car: cars that
+        were cancelled, never started or failed hold it below their own published_ts
+        """
+        finished, unfinished = [], []
+        for index, car_data in enumerate(cars):
+            published_ts = car_data.get('published_ts')
+            if published_ts is None or pd.isna(published_ts):
+                continue
+            processed = index < len(results) and (results[index] is not None or not self._is_postable(car_data))
+            (finished if processed else unfinished).append(published_ts)
+
+        if unfinished:
+            oldest_unfinished = min(unfinished)
+            finished = [published_ts for published_ts in finished if published_ts < oldest_unfinished]
+        return max(finished, default=None)
+
+    def _commit_watermark(self):
+        """Persist the watermark of the run just delivered; it never moves backwards"""
+        if self._pending_watermark is None:
+            return
+        current = self.get_watermark(self._last_query)
+        if current is None or self._pending_watermark > current:
+            self.watermarks.set(self._watermark_key(self._last_query), self._pending_watermark.isoformat())
+            st.info(f"📈 Watermark advanced to {self._pending_watermark.isoformat()}")
+        self._pending_watermark = None
+
     def send_posts_to_webhook(self, posts: List[Dict]) -> bool:
         """
-        Send posts as a flat dictionary payload to the webhook endpoint
+        Send posts to the webhook endpoint in chunks, in the configured webhook_format
+        Synchronous wrapper around asend_posts_to_webhook
+        """
+        return self._run(self.asend_posts_to_webhook(posts))
+
+    async def asend_posts_to_webhook(self, posts: List[Dict]) -> bool:
+        """
+        Send posts to the webhook endpoint in chunks of webhook_chunk_size, up to
+        webhook_concurrency at a time; a chunk that fails transiently is retried on
+        its own. The outcome of every chunk is recorded in webhook_outcomes
+        Returns: True if every chunk was delivered
         """
         st.info(f"🌐 Sending {len(posts)} posts to webhook endpoint")
         st.info(f"🔗 Webhook URL: {WEBHOOK_ENDPOINT}")
 
+        self.webhook_outcomes = []
         if not posts:
             st.warning("⚠️ No posts to send to webhook")
             return False
 
-        # Prepare payload as a flat dictionary with each post as a separate key
-        payload = {}
+        chunks = [posts[i:i + self.webhook_chunk_size] for i in range(0, len(posts), self.webhook_chunk_size)]
+        generated_at = datetime.now().isoformat()
+        semaphore = asyncio.Semaphore(self.webhook_concurrency)
+        st.info(f"📦 Delivering {len(chunks)} chunks of up to {self.webhook_chunk_size} posts, "
+                f"{self.webhook_concurrency} at a time")
+
+        self.webhook_outcomes = await asyncio.gather(*(
+            self._asend_webhook_chunk(chunk, chunk_number, len(chunks), len(posts), generated_at, semaphore)
+            for chunk_number, chunk in enumerate(chunks, start=1)
+        ))
+        for chunk, outcome in zip(chunks, self.webhook_outcomes):
+            if outcome['delivered']:
+                self._mark_posted(chunk, "delivered")
+
+        failed = [outcome for outcome in self.webhook_outcomes if not outcome['delivered']]
+        if not failed:
+            st.success(f"✅ Successfully sent {len(posts)} posts to webhook")
+            return True
+
+        st.error(f"❌ {len(failed)} of {len(chunks)} webhook chunks failed "
+                 f"({sum(outcome['posts'] for outcome in failed)} posts not delivered): "
+                 f"chunks {', '.join(str(outcome['chunk']) for outcome in failed)}")
+        return False
+
+    def deliver_outbox(self, include_failed: bool = False) -> bool:
+        """
+        Deliver the posts waiting in the outbox
+        Synchronous wrapper around adeliver_outbox
+        """
+        return self._run(self.adeliver_outbox(include_failed))
 
-        # Add metadata
-        payload["total_count"] = len(posts)
-        payload["generated_at"] = datetime.now().isoformat()
-        payload["source"] = "flash_sale_posts_generator"
+    async def adeliver_outbox(self, include_failed: bool = False) -> bool:
+        """
+        Send every pending outbox post to the webhook (oldest first, in chunks) and
+        acknowledge the chunks it accepts; failed chunks stay pending for the next attempt
+        include_failed also resends posts parked after too many failed attempts
+        Returns: True if nothing is left undelivered
+        """
+        expired = self.outbox.expire(OUTBOX_MAX_AGE)
+        if expired:
+            st.warning(f"⌛ {expired} undelivered posts are older than {OUTBOX_MAX_AGE // 3600} hours - not sending them")
+        self.outbox.prune(OUTBOX_RETENTION)
+
+        entries = self.outbox.claim(include_failed)
+        if not entries:
+            st.info("📭 No posts waiting in the outbox")
+            self.webhook_outcomes = []
+            return True
+
+        post_ids = [entry[0] for entry in entries]
+        settled = set()
+        st.info(f"📮 Delivering {len(entries)} posts from the outbox")
+        try:
+            delivered = await self.asend_posts_to_webhook([entry[1] for entry in entries])
+
+            # Chunk N holds the posts from (N - 1) * webhook_chunk_size onwards
+            for outcome in self.webhook_outcomes:
+                start = (outcome['chunk'] - 1) * self.webhook_chunk_size
+                chunk_ids = post_ids[start:start + outcome['posts']]
+                if outcome['delivered']:
+                    self.outbox.ack(chunk_ids)
+                else:
+                    self.outbox.fail(chunk_ids, outcome['error'] or f"status {outcome['status']}")
+                settled.update(chunk_ids)
+        finally:
+            # Claimed posts that never got an outcome (e.g. the run was stopped) go back to pending
+            self.outbox.release([post_id for post_id in post_ids if post_id not in settled])
+
+        counts = self.outbox.counts()
+        st.info(f"📮 Outbox: {counts['pending']} pending, {counts['sending']} being sent by other runs, "
+                f"{counts['failed']} failed, {counts['delivered']} delivered")
+        return delivered
+
+    @staticmethod
+    def _webhook_metadata(chunk: List[Dict], chunk_number: int, chunk_count: int, total_count: int,
+                          generated_at: str) -> Dict:
+        # total_count stays the number of posts in the whole delivery, as before chunking
+        return {
+            "total_count": total_count,
+            "generated_at": generated_at,
+            "source": "flash_sale_posts_generator",
+            "chunk_number": chunk_number,
+            "chunk_count": chunk_count,
+            "chunk_post_count": len(chunk)
+        }
 
-        # Add each post as a separate key in the dictionary
-        for i, post in enumerate(posts):
-            post_key = f"post_{i + 1}"
-            payload[post_key] = post
+    def _webhook_request(self, chunk: List[Dict], chunk_number: int, chunk_count: int, total_count: int,
+                         generated_at: str) -> Dict:
+        """
+        Body and headers (as httpx request arguments) for one chunk in webhook_format,
+        compressed with webhook_compression if set
+        """
+        metadata = self._webhook_metadata(chunk, chunk_number, chunk_count, total_count, generated_at)
+        headers = {
+            "Content-Type": "application/json",
+            "User-Agent": "FlashSalePostGenerator/1.0"
+        }
 
-        try:
-            st.info(f"🌐 Sending webhook request with {len(posts)} posts")
-
-            # Send POST request to webhook
-            response = requests.post(
-                WEBHOOK_ENDPOINT,
-                json=payload,
-                headers={
-                    "Content-Type": "application/json",
-                    "User-Agent": "FlashSalePostGenerator/1.0"
-                },
-                timeout=30
-            )
+        # Receivers dedupe on each post's idempotency_key: outbox resends re-chunk posts, so
+        # a chunk-level key wouldn't match. Only a single-post chunk also gets the header
+        if len(chunk) == 1 and chunk[0].get('idempotency_key'):
+            headers["Idempotency-Key"] = chunk[0]['idempotency_key']
+
+        compression = self.webhook_compression
+        if compression != "none":
+            headers["Content-Encoding"] = compression
+
+        if self.webhook_format == "ndjson":
+            # Streamed one post per line; metadata travels in headers
+            headers["Content-Type"] = "application/x-ndjson"
+            for key, value in metadata.items():
+                headers[f"X-{key.replace('_', '-').title()}"] = str(value)
+            body = NDJSONBody(chunk)
+            if compression != "none":
+                body = CompressedBody(body, compression, self.webhook_compression_level)
+            return {'content': body, 'headers': headers}
+
+        if self.webhook_format == "array":
+            payload = {**metadata, "posts": chunk}
+        else:
+            # Prepare payload as a flat dictionary with each post as a separate key
+            payload = dict(metadata)
+            for i, post in enumerate(chunk):
+                post_key = f"post_{i + 1}"
+                payload[post_key] = post
+
+        if compression == "none":
+            return {'json': payload, 'headers': headers}
+        body = json.dumps(payload, ensure_ascii=False, separators=(",", ":"), default=str).encode("utf-8")
+        return {'content': compress_body(body, compression, self.webhook_compression_level), 'headers': headers}
+
+    async def _asend_webhook_chunk(self, chunk: List[Dict], chunk_number: int, chunk_count: int, total_count: int,
+                                   generated_at: str, semaphore: asyncio.Semaphore) -> Dict:
+        """
+        Deliver one chunk of posts, retrying transient failures
+        Returns: {'chunk', 'posts', 'delivered', 'status', 'seconds', 'error'}
+        """
+        outcome = {'chunk': chunk_number, 'posts': len(chunk), 'delivered': False,
+                   'status': None, 'seconds': 0.0, 'error': None}
+        request = self._webhook_request(chunk, chunk_number, chunk_count, total_count, generated_at)
 
-            st.info(f"🌐 Webhook Response - Status Code: {response.status_code}")
-            st.info(f"🌐 Webhook Response Body: {response.text}")
+        async with semaphore:
+            started = time.perf_counter()
+            try:
+                # Send POST request to webhook
+                response = await self._apost_with_retry(
+                    WEBHOOK_ENDPOINT,
+                    max_retries=self.webhook_max_retries,
+                    **request
+                )
+                outcome['status'] = response.status_code
+                if response.status_code in [200, 201, 202]:
+                    outcome['delivered'] = True
+                else:
+                    outcome['error'] = response.text[:200]
+            except RunBudgetExceeded:
+                outcome['error'] = "run budget exhausted before the request could be sent"
+            except httpx.TimeoutException:
+                outcome['error'] = "request timed out"
+            except httpx.HTTPError as e:
+                outcome['error'] = f"request failed with exception: {e}"
+            except Exception as e:
+                outcome['error'] = f"unexpected error: {e}"
+            outcome['seconds'] = round(time.perf_counter() - started, 3)
 
-            if response.status_code in [200, 201, 202]:
-                st.success(f"✅ Successfully sent {len(posts)} posts to webhook")
-                return True
-            else:
-                st.error(f"❌ Webhook request failed with status {response.status_code}: {response.text}")
-                return False
+        if outcome['delivered']:
+            st.info(f"🌐 Chunk {chunk_number}/{chunk_count}: {len(chunk)} posts delivered "
+                    f"(status {outcome['status']}, {outcome['seconds']:.2f}s)")
+        else:
+            st.error(f"❌ Chunk {chunk_number}/{chunk_count} failed "
+                     f"(status {outcome['status']}): {outcome['error']}")
+        return outcome
 
-        except requests.exceptions.Timeout:
-            st.error("❌ Webhook request timed out")
-            return False
-        except requests.exceptions.RequestException as e:
-            st.error(f"❌ Webhook request failed with exception: {e}")
-            return False
-        except Exception as e:
-            st.error(f"❌ Unexpected error sending to webhook: {e}")
-            return False
+    def generate_and_send_posts(self, custom_query: str = None) -> tuple[List[Dict], bool]:
+        """
+        Generate posts and deliver them to the webhook in a single event loop
+        Synchronous wrapper around agenerate_and_send_posts
+        """
+        return self._run(self.agenerate_and_send_posts(custom_query))
+
+    async def agenerate_and_send_posts(self, custom_query: str = None) -> tuple[List[Dict], bool]:
+        """
+        Run the full generate -> webhook flow, within run_budget if one is set
+        Returns: (posts, webhook_success)
+        """
+        started_run = self._start_run()
+        try:
+            posts = await self.agenerate_posts(custom_query)
+            if not posts and self.outbox is None:
+                return posts, False
+
+            st.info("🌐 Sending posts to webhook...")
+            with self.timings.stage("webhook_delivery"):
+                if self.outbox is not None:
+                    # Persist first, so a failed delivery can be resent without regenerating.
+                    # The outbox is drained even without new posts: earlier failures are retried
+                    if posts:
+                        self.outbox.add(uuid.uuid4().hex, posts)
+                        self._mark_posted(posts, "queued")
+                    webhook_success = await self.adeliver_outbox()
+                else:
+                    webhook_success = await self.asend_posts_to_webhook(posts)
+            if webhook_success:
+                self._commit_watermark()
+            return posts, webhook_success
+        finally:
+            if started_run:
+                self._end_run()
 
 
 def run_flash_sale_generation():
@@ -447,20 +2598,73 @@ def run_flash_sale_generation():
     try:
         # Get custom query from session state
         custom_query = st.session_state.get('custom_query', None)
+        link_concurrency = st.session_state.get('link_concurrency', TRACKING_LINK_CONCURRENCY)
+        use_link_cache = st.session_state.get('use_link_cache', True)
+        bulk_links = st.session_state.get('bulk_links', False)
+        link_batch_size = st.session_state.get('link_batch_size', TRACKING_LINK_BATCH_SIZE)
+        link_max_retries = st.session_state.get('link_max_retries', TRACKING_LINK_MAX_RETRIES)
+        link_rate_limit = st.session_state.get('link_rate_limit')
+        run_budget = st.session_state.get('run_budget')
+        hedge_links = st.session_state.get('hedge_links', False)
+        use_storage_api = st.session_state.get('use_storage_api', False)
+        stream_results = st.session_state.get('stream_results', False)
+        page_size = st.session_state.get('page_size', QUERY_PAGE_SIZE)
+        use_query_cache = st.session_state.get('use_query_cache', True)
+        force_refresh = st.session_state.get('force_refresh', False)
+        max_bytes_scanned = st.session_state.get('max_bytes_scanned', QUERY_MAX_BYTES_SCANNED)
+        incremental = st.session_state.get('incremental', False)
+        pushdown_filters = st.session_state.get('pushdown_filters', False)
+        webhook_chunk_size = st.session_state.get('webhook_chunk_size', WEBHOOK_CHUNK_SIZE)
+        webhook_concurrency = st.session_state.get('webhook_concurrency', WEBHOOK_CONCURRENCY)
+        webhook_max_retries = st.session_state.get('webhook_max_retries', WEBHOOK_MAX_RETRIES)
+        webhook_format = st.session_state.get('webhook_format', WEBHOOK_FORMAT)
+        webhook_compression = st.session_state.get('webhook_compression', WEBHOOK_COMPRESSION)
+        webhook_compression_level = st.session_state.get('webhook_compression_level')
+        use_outbox = st.session_state.get('use_outbox', True)
+        skip_posted = st.session_state.get('skip_posted', True)
+        start_date = st.session_state.get('start_date')
+        end_date = st.session_state.get('end_date')
+        status_before = st.session_state.get('status_before', DEFAULT_STATUS_BEFORE)
+        status_after = st.session_state.get('status_after', DEFAULT_STATUS_AFTER)
         
         # Initialize the post generator
         st.info("🔧 Initializing Flash Sale Post Generator...")
-        generator = FlashSalePostGenerator()
-
-        # Generate posts
+        generator = FlashSalePostGenerator(
+            link_concurrency=link_concurrency,
+            use_link_cache=use_link_cache,
+            bulk_links=bulk_links,
+            link_batch_size=link_batch_size,
+            link_max_retries=link_max_retries,
+            link_rate_limit=link_rate_limit,
+            run_budget=run_budget,
+            hedge_links=hedge_links,
+            use_storage_api=use_storage_api,
+            stream_results=stream_results,
+            page_size=page_size,
+            use_query_cache=use_query_cache,
+            force_refresh=force_refresh,
+            max_bytes_scanned=max_bytes_scanned,
+            incremental=incremental,
+            start_date=start_date,
+            end_date=end_date,
+            status_before=status_before,
+            status_after=status_after,
+            pushdown_filters=pushdown_filters,
+            webhook_chunk_size=webhook_chunk_size,
+            webhook_concurrency=webhook_concurrency,
+            webhook_max_retries=webhook_max_retries,
+            webhook_format=webhook_format,
+            webhook_compression=webhook_compression,
+            webhook_compression_level=webhook_compression_level,
+            use_outbox=use_outbox,
+            skip_posted=skip_posted
+        )
+
+        # Generate posts and send them to the webhook endpoint
         st.info("📱 Generating flash sale posts...")
-        posts = generator.generate_posts(custom_query)
+        posts, webhook_success = generator.generate_and_send_posts(custom_query)
 
         if posts:
-            # Send to webhook endpoint
-            st.info("🌐 Sending posts to webhook...")
-            webhook_success = generator.send_posts_to_webhook(posts)
-
             # Also print to console for immediate use
             st.info("📄 Generated posts JSON:")
             st.json(posts)
@@ -475,15 +2679,27 @@ def run_flash_sale_generation():
                 'success': True,
                 'posts': posts,
                 'webhook_success': webhook_success,
-                'total_posts': len(posts)
+                'total_posts': len(posts),
+                'timings': generator.timings,
+                'webhook_outcomes': generator.webhook_outcomes,
+                'outbox': generator.outbox.counts() if generator.outbox is not None else None
             }
         else:
             st.info("ℹ️ No posts generated - no flash sale cars found or all failed processing")
+            # Posts left in the outbox by earlier runs may still have been delivered
+            if generator.webhook_outcomes:
+                if webhook_success:
+                    st.success("🌐 ✅ Posts waiting in the outbox sent to webhook successfully!")
+                else:
+                    st.error("🌐 ❌ Failed to send posts waiting in the outbox")
             return {
                 'success': True,
                 'posts': [],
-                'webhook_success': False,
-                'total_posts': 0
+                'webhook_success': webhook_success and bool(generator.webhook_outcomes),
+                'total_posts': 0,
+                'timings': generator.timings,
+                'webhook_outcomes': generator.webhook_outcomes,
+                'outbox': generator.outbox.counts() if generator.outbox is not None else None
             }
 
     except Exception as e:
@@ -497,6 +2713,39 @@ def run_flash_sale_generation():
         }
 
 
+def resend_outbox_posts():
+    """Deliver posts left in the outbox by earlier runs, without regenerating them"""
+    try:
+        generator = FlashSalePostGenerator(
+            webhook_chunk_size=st.session_state.get('webhook_chunk_size', WEBHOOK_CHUNK_SIZE),
+            webhook_concurrency=st.session_state.get('webhook_concurrency', WEBHOOK_CONCURRENCY),
+            webhook_max_retries=st.session_state.get('webhook_max_retries', WEBHOOK_MAX_RETRIES),
+            webhook_format=st.session_state.get('webhook_format', WEBHOOK_FORMAT),
+            webhook_compression=st.session_state.get('webhook_compression', WEBHOOK_COMPRESSION),
+            webhook_compression_level=st.session_state.get('webhook_compression_level'),
+            use_outbox=True
+        )
+        webhook_success = generator.deliver_outbox(include_failed=True)
+        if webhook_success:
+            st.success("🌐 ✅ Outbox delivered - nothing left to send")
+        else:
+            st.error("🌐 ❌ Some posts could not be delivered and are still in the outbox")
+        return {
+            'success': True,
+            'webhook_success': webhook_success,
+            'webhook_outcomes': generator.webhook_outcomes,
+            'outbox': generator.outbox.counts()
+        }
+
+    except Exception as e:
+        st.error(f"💥 Critical error while resending outbox posts: {e}")
+        return {
+            'success': False,
+            'webhook_success': False,
+            'error': str(e)
+        }
+
+
 def main():
     # Header
     st.markdown('<h1 class="main-header">🚗 Flash Sale Posts Generator</h1>', unsafe_allow_html=True)
@@ -513,18 +2762,6 @@ def main():
     # Query Configuration Section
     st.markdown("## ⚙️ Query Configuration")
     
-    # Default query
-    default_query = """SELECT DISTINCT a.car_name as sf_vehicle_name,
-a.vehicle_id as ajans_vehicle_id,
-DATE(a.log_date) AS published_at,
-b.car_make,
-b.car_model,
-b.car_year,
-b.kilometrage
-FROM ajans_dealers.wholesale_vehicle_activity_logs a 
-LEFT JOIN reporting.vehicle_acquisition_to_selling b ON a.car_name = b.car_name
-WHERE DATE(log_date) = current_date() AND status_before = "created" AND status_after = "published\""""
-    
     # Instructions
     st.markdown("""
     **⚠️ Required Column Names:**
@@ -536,18 +2773,243 @@ WHERE DATE(log_date) = current_date() AND status_before = "created" AND status_a
     - `car_model` - Car model
     - `car_year` - Car year
     - `kilometrage` - Car mileage/kilometers
+
+    For incremental mode, also return `published_ts` (publication TIMESTAMP) and filter on
+    `@watermark` (TIMESTAMP), which is NULL on the first run and the last delivered `published_ts` after that.
+
+    **Query parameters:** `@start_date`, `@end_date` (DATE, default today in UTC),
+    `@status_before`, `@status_after` (STRING) are set from the fields below the query.
     """)
     
     # Query input
     custom_query = st.text_area(
         "📝 BigQuery SQL (modify as needed):",
-        value=default_query,
+        value=DEFAULT_QUERY,
         height=200,
         help="Modify this query but ensure it returns all required columns with exact names listed above"
     )
     
     # Store the query in session state
     st.session_state['custom_query'] = custom_query
+
+    # Query parameters
+    custom_date_range = st.checkbox(
+        "📅 Custom date range",
+        value=False,
+        help="By default @start_date and @end_date are today's date (UTC) at the time of the run."
+    )
+    param_col1, param_col2, param_col3, param_col4 = st.columns(4)
+    with param_col1:
+        start_date = st.date_input("📅 Published from:", disabled=not custom_date_range)
+    with param_col2:
+        end_date = st.date_input("📅 Published to:", disabled=not custom_date_range)
+    with param_col3:
+        status_before = st.text_input("🔀 Status before:", value=DEFAULT_STATUS_BEFORE)
+    with param_col4:
+        status_after = st.text_input("🔀 Status after:", value=DEFAULT_STATUS_AFTER)
+    st.session_state['start_date'] = start_date if custom_date_range else None
+    st.session_state['end_date'] = end_date if custom_date_range else None
+    st.session_state['status_before'] = status_before
+    st.session_state['status_after'] = status_after
+
+    # Query result cache controls
+    cache_col1, cache_col2 = st.columns(2)
+    with cache_col1:
+        use_query_cache = st.checkbox(
+            "💾 Reuse cached query results",
+            value=True,
+            help=f"Identical queries run today reuse results for up to {QUERY_CACHE_TTL // 60} minutes."
+        )
+    with cache_col2:
+        force_refresh = st.checkbox(
+            "🔄 Force refresh",
+            value=False,
+            help="Run the query in BigQuery even if cached results exist, and update the cache."
+        )
+    st.session_state['use_query_cache'] = use_query_cache
+    st.session_state['force_refresh'] = force_refresh
+
+    # Cost guard
+    max_gb_scanned = st.number_input(
+        "💰 Maximum data scanned per query (GB, 0 = no limit):",
+        min_value=0.0,
+        value=QUERY_MAX_BYTES_SCANNED / 1024 ** 3,
+        step=1.0,
+        help="Queries are dry-run first and rejected if BigQuery estimates they would process more than this."
+    )
+    st.session_state['max_bytes_scanned'] = int(max_gb_scanned * 1024 ** 3)
+
+    # Incremental mode
+    incremental_col1, incremental_col2 = st.columns([3, 1])
+    with incremental_col1:
+        incremental = st.checkbox(
+            "📈 Incremental mode: only fetch cars published since the last successful run",
+            value=False,
+            help="The latest delivered published_ts is stored per query and passed in as @watermark."
+        )
+    with incremental_col2:
+        if st.button("↩️ Reset watermark", key="reset_watermark"):
+            get_watermark_store().clear()
+            st.success("✅ Watermarks cleared - the next run fetches all of today's cars")
+    st.session_state['incremental'] = incremental
+
+    # Cross-run dedup
+    skip_posted = st.checkbox(
+        "⏭️ Skip cars already posted today",
+        value=True,
+        help="Each post carries an idempotency_key (vehicle + publish date) the webhook can dedupe on. "
+             "Cars whose post was already delivered or queued are skipped."
+    )
+    st.session_state['skip_posted'] = skip_posted
+
+    # Performance settings
+    with st.expander("⚡ Performance Settings"):
+        use_storage_api = st.checkbox(
+            "🏹 Download query results with the BigQuery Storage Read API",
+            value=False,
+            help="Faster for large results. Falls back to the regular API if the storage API is unavailable."
+        )
+        pushdown_filters = st.checkbox(
+            "🧹 Filter and deduplicate in BigQuery",
+            value=False,
+            help="Cars without make, model or ajans ID are dropped and each vehicle is kept once "
+                 "inside the query, so only postable cars are downloaded."
+        )
+        stream_results = st.checkbox(
+            "🌊 Stream query results page by page",
+            value=False,
+            help="Start creating tracking links as soon as the first page of results arrives. "
+                 "Downloads are held back while a few pages wait for links; the cars and posts "
+                 "are still kept in memory for the whole run."
+        )
+        page_size = st.number_input(
+            "📄 Rows per result page:",
+            min_value=10,
+            max_value=100000,
+            value=QUERY_PAGE_SIZE,
+            disabled=not stream_results
+        )
+        link_concurrency = st.number_input(
+            "🔗 Parallel tracking link requests:",
+            min_value=1,
+            max_value=2000,
+            value=TRACKING_LINK_CONCURRENCY,
+            help="How many tracking links are created at the same time. Use 1 to create them one by one."
+        )
+        use_link_cache = st.checkbox(
+            "💾 Reuse cached tracking links",
+            value=True,
+            help="Links already created today are read from the local cache instead of calling the API again."
+        )
+        bulk_links = st.checkbox(
+            "📦 Create tracking links in bulk",
+            value=False,
+            help="Send many links per request to the bulk endpoint. Falls back to one request per car if it is unavailable."
+        )
+        link_batch_size = st.number_input(
+            "📦 Links per bulk request:",
+            min_value=1,
+            max_value=1000,
+            value=TRACKING_LINK_BATCH_SIZE,
+            disabled=not bulk_links
+        )
+        link_max_retries = st.number_input(
+            "🔁 Retries per tracking link request:",
+            min_value=0,
+            max_value=10,
+            value=TRACKING_LINK_MAX_RETRIES,
+            help="Transient errors (timeouts, 429, 5xx) are retried with exponential backoff."
+        )
+        link_rate_limit = st.number_input(
+            "🚦 Max tracking link requests per second (0 = unlimited):",
+            min_value=0.0,
+            max_value=1000.0,
+            value=TRACKING_LINK_RATE_LIMIT,
+            help="Applies to this run only. Requests are throttled client-side; a 429 from the API "
+                 "lowers the rate automatically."
+        )
+        run_budget = st.number_input(
+            "⏱️ Run time budget in seconds (0 = no limit):",
+            min_value=0,
+            max_value=3600,
+            value=0,
+            help="Unfinished tracking links are cancelled when the budget runs out; only completed posts are sent."
+        )
+        hedge_links = st.checkbox(
+            "🏁 Hedge slow tracking link requests",
+            value=False,
+            help=f"Send a duplicate request when one is slower than the p{HEDGE_PERCENTILE} latency; the first success wins."
+        )
+        webhook_chunk_size = st.number_input(
+            "📦 Posts per webhook request:",
+            min_value=1,
+            max_value=10000,
+            value=WEBHOOK_CHUNK_SIZE,
+            help="Posts are split into chunks so a large day isn't sent as one huge request."
+        )
+        webhook_concurrency = st.number_input(
+            "🌐 Parallel webhook requests:",
+            min_value=1,
+            max_value=32,
+            value=WEBHOOK_CONCURRENCY
+        )
+        webhook_max_retries = st.number_input(
+            "🔁 Retries per webhook chunk:",
+            min_value=0,
+            max_value=10,
+            value=WEBHOOK_MAX_RETRIES,
+            help="Only chunks that fail with a transient error (timeouts, 429, 5xx) are retried."
+        )
+        webhook_format = st.selectbox(
+            "📨 Webhook payload format:",
+            options=WEBHOOK_FORMATS,
+            index=WEBHOOK_FORMATS.index(WEBHOOK_FORMAT),
+            format_func={
+                "flat": "Flat (post_1, post_2, ... keys)",
+                "array": "JSON array under \"posts\"",
+                "ndjson": "NDJSON (one post per line, streamed)"
+            }.get,
+            help="The receiver must understand the chosen format; flat is the original format."
+        )
+        webhook_compression = st.selectbox(
+            "🗜️ Webhook body compression:",
+            options=WEBHOOK_COMPRESSIONS,
+            index=WEBHOOK_COMPRESSIONS.index(WEBHOOK_COMPRESSION),
+            help="Sent with a Content-Encoding header; the receiver must accept it. zstd needs the zstandard package."
+        )
+        webhook_compression_level = st.slider(
+            "🗜️ Compression level:",
+            min_value=1,
+            max_value=22 if webhook_compression == "zstd" else 9,
+            value=WEBHOOK_COMPRESSION_LEVELS.get(webhook_compression, 6),
+            disabled=webhook_compression == "none",
+            help="Higher levels produce smaller bodies at more CPU cost (gzip 1-9, zstd 1-22)."
+        )
+        use_outbox = st.checkbox(
+            "📮 Keep posts in the outbox until the webhook accepts them",
+            value=True,
+            help="Posts are saved locally before sending; failed deliveries can be resent "
+                 "without querying BigQuery or creating tracking links again."
+        )
+    st.session_state['use_storage_api'] = use_storage_api
+    st.session_state['stream_results'] = stream_results
+    st.session_state['pushdown_filters'] = pushdown_filters
+    st.session_state['page_size'] = int(page_size)
+    st.session_state['link_concurrency'] = int(link_concurrency)
+    st.session_state['hedge_links'] = hedge_links
+    st.session_state['run_budget'] = float(run_budget)
+    st.session_state['link_rate_limit'] = float(link_rate_limit)
+    st.session_state['link_max_retries'] = int(link_max_retries)
+    st.session_state['use_link_cache'] = use_link_cache
+    st.session_state['bulk_links'] = bulk_links
+    st.session_state['link_batch_size'] = int(link_batch_size)
+    st.session_state['webhook_chunk_size'] = int(webhook_chunk_size)
+    st.session_state['webhook_concurrency'] = int(webhook_concurrency)
+    st.session_state['webhook_max_retries'] = int(webhook_max_retries)
+    st.session_state['webhook_format'] = webhook_format
+    st.session_state['webhook_compression'] = webhook_compression
+    st.session_state['webhook_compression_level'] = int(webhook_compression_level)
+    st.session_state['use_outbox'] = use_outbox
     
     # Query validation preview
     if st.button("🔍 Validate Query", key="validate_query"):
@@ -555,19 +3017,48 @@ WHERE DATE(log_date) = current_date() AND status_before = "created" AND status_a
         
         # Create a temporary generator to use validation method
         try:
-            temp_generator = FlashSalePostGenerator()
-            is_valid, missing_columns = temp_generator.validate_query_columns(custom_query)
+            temp_generator = FlashSalePostGenerator(max_bytes_scanned=st.session_state['max_bytes_scanned'],
+                                                    incremental=st.session_state['incremental'],
+                                                    start_date=st.session_state['start_date'],
+                                                    end_date=st.session_state['end_date'],
+                                                    status_before=st.session_state['status_before'],
+                                                    status_after=st.session_state['status_after'])
+            is_valid, problems = temp_generator.validate_query_columns(custom_query)
             
             if is_valid:
-                st.success("✅ Query validation passed! All required columns are present.")
+                st.success("✅ Query validation passed! All required columns are present with compatible types.")
             else:
-                st.error(f"❌ Query validation failed! Missing columns: {', '.join(missing_columns)}")
-                st.info("Please ensure your query returns all required columns with exact names.")
+                st.error(f"❌ Query validation failed! {', '.join(problems)}")
+                st.info("Please ensure your query returns all required columns with exact names and compatible types.")
+
+            # Cost estimate from a dry run
+            estimate = temp_generator.dry_run_query(custom_query)
+            if estimate['error']:
+                st.error(f"❌ Dry run failed: {estimate['error']}")
+            else:
+                st.metric("Estimated data processed", format_bytes(estimate['bytes_processed']))
+                max_bytes_scanned = temp_generator.max_bytes_scanned
+                if max_bytes_scanned is not None and estimate['bytes_processed'] > max_bytes_scanned:
+                    st.error(f"❌ Over the {format_bytes(max_bytes_scanned)} limit - this query will be rejected")
+                if estimate['schema']:
+                    st.markdown("**Output schema:**")
+                    st.dataframe(pd.DataFrame(estimate['schema']), use_container_width=True, hide_index=True)
         except Exception as e:
             st.error(f"❌ Error during validation: {e}")
 
     
 
+    # Posts left undelivered by earlier runs
+    outbox_counts = get_webhook_outbox().counts()
+    undelivered = outbox_counts['pending'] + outbox_counts['failed']
+    if undelivered:
+        st.warning(f"📮 {undelivered} posts from earlier runs are waiting in the outbox")
+        if st.button("📮 Resend undelivered posts", key="resend_outbox"):
+            resend_result = resend_outbox_posts()
+            if resend_result.get('webhook_outcomes'):
+                st.dataframe(pd.DataFrame(resend_result['webhook_outcomes']), use_container_width=True,
+                             hide_index=True)
+
     # Button container
     st.markdown('<div class="button-container">', unsafe_allow_html=True)
 
@@ -638,6 +3129,26 @@ WHERE DATE(log_date) = current_date() AND status_before = "created" AND status_a
             else:
                 st.info("ℹ️ No posts were generated - no flash sale cars found for today")
 
+            if result.get('webhook_outcomes'):
+                # Per-chunk webhook delivery
+                st.markdown("## 📦 Webhook Delivery")
+                st.dataframe(pd.DataFrame(result['webhook_outcomes']), use_container_width=True, hide_index=True)
+
+            if result.get('outbox') and (result['outbox']['pending'] or result['outbox']['failed']):
+                st.warning(f"📮 {result['outbox']['pending'] + result['outbox']['failed']} posts are waiting "
+                           f"in the outbox - use \"Resend undelivered posts\" to retry them")
+
+            if result.get('timings') is not None:
+                # Timing report
+                st.markdown("## ⏱️ Timing")
+                st.dataframe(result['timings'].to_frame(), use_container_width=True, hide_index=True)
+                st.download_button(
+                    "📥 Download timings JSON",
+                    data=json.dumps(result['timings'].to_dict(), indent=2),
+                    file_name=f"flash_sale_timings_{datetime.now().strftime('%Y%m%d_%H%M%S')}.json",
+                    mime="application/json"
+                )
+
         else:
             st.markdown('<div class="status-box error-box">', unsafe_allow_html=True)
             st.error("❌ Flash sale posts generation failed!")
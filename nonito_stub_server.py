@@ -0,0 +1,294 @@
+"""
+Local stand-in for the nonito.xyz tracking link API and the n8n webhook
+
+Serves the per-car endpoint (/create_tracking_link), the bulk endpoint
+(/create_tracking_links) and accepts any other POST as a webhook delivery,
+with a configurable simulated latency. Useful for exercising the generator
+offline:
+
+    python nonito_stub_server.py --port 8765
+    TRACKING_LINK_ENDPOINT=http://127.0.0.1:8765/create_tracking_link \\
+    TRACKING_LINK_BULK_ENDPOINT=http://127.0.0.1:8765/create_tracking_links \\
+    WEBHOOK_ENDPOINT=http://localhost:8765/webhook streamlit run main.py
+
+or to compare per-car and bulk link creation:
+
+    python nonito_stub_server.py --benchmark 500
+
+or to compare webhook body compression for 100, 1k and 10k posts (optionally over a
+link limited to some Mbit/s):
+
+    python nonito_stub_server.py --webhook-benchmark --bandwidth 20
+"""
+import argparse
+import json
+import logging
+import os
+import threading
+import time
+import zlib
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+
+class StubHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, format, *args):
+        pass
+
+    def _read_body(self) -> bytes:
+        if self.headers.get("Transfer-Encoding", "").lower() == "chunked":
+            body = b""
+            while True:
+                size = int(self.rfile.readline().strip(), 16)
+                if size == 0:
+                    self.rfile.readline()
+                    return body
+                body += self.rfile.read(size)
+                self.rfile.readline()
+        return self.rfile.read(int(self.headers.get("Content-Length") or 0))
+
+    def _respond(self, status: int, data, headers: dict = None):
+        body = json.dumps(data).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _throttled(self) -> bool:
+        """Answer 429 (with Retry-After) while the server has throttled responses left to give"""
+        server = self.server
+        with server.lock:
+            if server.throttle_remaining <= 0:
+                return False
+            server.throttle_remaining -= 1
+            server.counts["throttled"] += 1
+        self._respond(429, {"error": "rate limited"}, {"Retry-After": str(server.retry_after)})
+        return True
+
+    def do_POST(self):
+        server = self.server
+        body = self._read_body()
+        path = self.path.rstrip("/")
+
+        if path.endswith("/create_tracking_links"):
+            with server.lock:
+                server.counts["bulk"] += 1
+            if self._throttled():
+                return
+            if not server.bulk_enabled:
+                self._respond(404, {"error": "not found"})
+                return
+            links = json.loads(body)["links"]
+            time.sleep(server.latency + server.per_link_latency * len(links))
+            self._respond(200, {"links": [
+                {"link_name": link["link_name"], "tracking_link": f"https://elajans.link/{link['link_name']}"}
+                for link in links
+            ]})
+        elif path.endswith("/create_tracking_link"):
+            with server.lock:
+                server.counts["single"] += 1
+            if self._throttled():
+                return
+            link = json.loads(body)
+            time.sleep(server.latency + server.per_link_latency)
+            self._respond(200, {"tracking_link": f"https://elajans.link/{link['link_name']}"})
+        else:
+            # Time to receive the body over a link of the simulated bandwidth
+            if server.bandwidth:
+                time.sleep(len(body) / server.bandwidth)
+            encoding = self.headers.get("Content-Encoding", "")
+            try:
+                if encoding == "gzip":
+                    decoded = zlib.decompress(body, 16 + zlib.MAX_WBITS)
+                elif encoding == "zstd":
+                    decoded = zstandard.ZstdDecompressor().decompressobj().decompress(body)
+                else:
+                    decoded = body
+                if self.headers.get("Content-Type") == "application/x-ndjson":
+                    posts = [json.loads(line) for line in decoded.splitlines() if line]
+                else:
+                    posts = json.loads(decoded)
+            except Exception as e:
+                self._respond(400, {"error": f"undecodable body: {e}"})
+                return
+            with server.lock:
+                server.counts["webhook"] += 1
+                server.webhook_bytes += len(body)
+                server.webhook_decoded_bytes += len(decoded)
+            time.sleep(server.latency)
+            self._respond(200, {"received": len(body), "records": len(posts)})
+
+
+def start_stub_server(port: int = 0, latency: float = 0.05, per_link_latency: float = 0.001,
+                      bulk_enabled: bool = True, bandwidth: float = 0) -> ThreadingHTTPServer:
+    """
+    Start the stub server in a background thread
+    Use port 0 to pick a free port; the bound address is server.server_address
+    bandwidth (bytes per second, 0 = unlimited) delays webhooks by their body size
+    Setting server.throttle_remaining makes that many tracking link requests get a 429
+    with a Retry-After of server.retry_after seconds
+    """
+    server = ThreadingHTTPServer(("127.0.0.1", port), StubHandler)
+    server.daemon_threads = True
+    server.latency = latency
+    server.per_link_latency = per_link_latency
+    server.bulk_enabled = bulk_enabled
+    server.bandwidth = bandwidth
+    server.lock = threading.Lock()
+    server.throttle_remaining = 0
+    server.retry_after = 1
+    server.counts = {"single": 0, "bulk": 0, "webhook": 0, "throttled": 0}
+    server.webhook_bytes = 0
+    server.webhook_decoded_bytes = 0
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def point_app_at(server: ThreadingHTTPServer):
+    """
+    Route the generator's endpoints to the stub server (call before importing main)
+    The webhook is addressed as localhost so its per-host pool and rate limit stay
+    separate from the tracking link API's, as they are in production
+    """
+    port = server.server_address[1]
+    base_url = f"http://{server.server_address[0]}:{port}"
+    os.environ["TRACKING_LINK_ENDPOINT"] = f"{base_url}/create_tracking_link"
+    os.environ["TRACKING_LINK_BULK_ENDPOINT"] = f"{base_url}/create_tracking_links"
+    os.environ["WEBHOOK_ENDPOINT"] = f"http://localhost:{port}/webhook"
+
+
+def _offline_generator_class():
+    """FlashSalePostGenerator subclass fed with synthetic cars (import main only after point_app_at)"""
+    from main import FlashSalePostGenerator
+
+    class OfflineGenerator(FlashSalePostGenerator):
+        """Generator fed with synthetic cars; never talks to BigQuery"""
+
+        def __init__(self, cars, **kwargs):
+            self._cars = cars
+            super().__init__(**kwargs)
+
+        def _get_bigquery_client(self):
+            return "offline"
+
+        def get_flash_sale_cars(self, custom_query: str = None):
+            return self._cars
+
+    return OfflineGenerator
+
+
+def synthetic_cars(car_count: int) -> list:
+    return [
+        {
+            'sf_vehicle_name': f"BENCH{i:05d}",
+            'ajans_vehicle_id': str(100000 + i),
+            'make': "Toyota",
+            'model': "Corolla",
+            'year': 2020,
+            'kilometers': 50000 + i,
+            'published_at': None
+        }
+        for i in range(car_count)
+    ]
+
+
+def run_benchmark(car_count: int, batch_size: int, concurrency: int, latency: float):
+    """
+    Time per-car against bulk tracking link creation for car_count cars
+    """
+    server = start_stub_server(latency=latency)
+    point_app_at(server)
+    logging.getLogger("streamlit").setLevel(logging.ERROR)
+
+    OfflineGenerator = _offline_generator_class()
+    cars = synthetic_cars(car_count)
+
+    print(f"{'mode':<10}{'seconds':>10}{'requests':>10}{'posts':>8}")
+    for bulk in (False, True):
+        generator = OfflineGenerator(cars, link_concurrency=concurrency, use_link_cache=False,
+                                     bulk_links=bulk, link_batch_size=batch_size, skip_posted=False)
+        before = dict(server.counts)
+        started = time.perf_counter()
+        posts = generator.generate_posts()
+        elapsed = time.perf_counter() - started
+        requests_made = sum(server.counts[key] - before[key] for key in ("single", "bulk"))
+        print(f"{'bulk' if bulk else 'per-car':<10}{elapsed:>10.2f}{requests_made:>10}{len(posts):>8}")
+
+    server.shutdown()
+
+
+def run_webhook_benchmark(post_counts, latency: float, bandwidth_mbps: float, payload_format: str,
+                          level=None):
+    """
+    Compare bytes on the wire and end-to-end send time of uncompressed, gzip and zstd
+    webhook bodies for each number of posts
+    """
+    server = start_stub_server(latency=latency, bandwidth=bandwidth_mbps * 1_000_000 / 8)
+    point_app_at(server)
+    logging.getLogger("streamlit").setLevel(logging.ERROR)
+
+    import main
+    OfflineGenerator = _offline_generator_class()
+    # Measure the transfer itself, not the client-side webhook rate limit
+    main.get_http_runtime().set_rate_limit(main.WEBHOOK_ENDPOINT, 0)
+
+    compressions = [c for c in main.WEBHOOK_COMPRESSIONS if c != "zstd" or main.zstandard is not None]
+    print(f"{'posts':>7}  {'encoding':<9}{'bytes':>13}{'ratio':>8}{'seconds':>10}")
+    for post_count in post_counts:
+        cars = synthetic_cars(post_count)
+        for compression in compressions:
+            generator = OfflineGenerator(cars, use_link_cache=False, bulk_links=True, skip_posted=False,
+                                         webhook_format=payload_format, webhook_compression=compression,
+                                         webhook_compression_level=level)
+            posts = generator.generate_posts()
+            sent_before, decoded_before = server.webhook_bytes, server.webhook_decoded_bytes
+            started = time.perf_counter()
+            delivered = generator.send_posts_to_webhook(posts)
+            elapsed = time.perf_counter() - started
+            sent = server.webhook_bytes - sent_before
+            decoded = server.webhook_decoded_bytes - decoded_before
+            status = "" if delivered else "  (delivery failed)"
+            print(f"{post_count:>7}  {compression:<9}{sent:>13,}{decoded / max(sent, 1):>7.1f}x"
+                  f"{elapsed:>10.3f}{status}")
+
+    server.shutdown()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--latency", type=float, default=0.05, help="Simulated seconds per request")
+    parser.add_argument("--no-bulk", action="store_true", help="Answer 404 on the bulk endpoint")
+    parser.add_argument("--benchmark", type=int, metavar="CARS", help="Run the per-car vs bulk benchmark")
+    parser.add_argument("--batch-size", type=int, default=50)
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--webhook-benchmark", action="store_true",
+                        help="Compare webhook body compression for 100, 1k and 10k posts")
+    parser.add_argument("--bandwidth", type=float, default=0,
+                        help="Simulated webhook link speed in Mbit/s (0 = unlimited)")
+    parser.add_argument("--format", default="flat", choices=("flat", "array", "ndjson"),
+                        help="Webhook payload format for the webhook benchmark")
+    parser.add_argument("--level", type=int, help="Compression level (default per encoding)")
+    args = parser.parse_args()
+
+    if args.benchmark:
+        run_benchmark(args.benchmark, args.batch_size, args.concurrency, args.latency)
+    elif args.webhook_benchmark:
+        run_webhook_benchmark((100, 1000, 10000), args.latency, args.bandwidth, args.format, args.level)
+    else:
+        stub = start_stub_server(args.port, args.latency, bulk_enabled=not args.no_bulk,
+                                 bandwidth=args.bandwidth * 1_000_000 / 8)
+        print(f"Stub server listening on http://127.0.0.1:{stub.server_address[1]}")
+        try:
+            threading.Event().wait()
+        except KeyboardInterrupt:
+            stub.shutdown()
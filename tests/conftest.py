@@ -0,0 +1,48 @@
+"""
+Shared test setup: main is pointed at a local nonito_stub_server and keeps its caches
+in a temporary directory, so no test talks to BigQuery, nonito.xyz or n8n
+"""
+import logging
+import os
+import sys
+import tempfile
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import nonito_stub_server  # noqa: E402
+
+# Must happen before main is imported: endpoints and cache paths are read at import time
+os.environ["FLASH_SALE_CACHE_DIR"] = tempfile.mkdtemp(prefix="flash-sale-tests-")
+STUB_SERVER = nonito_stub_server.start_stub_server(latency=0.01, per_link_latency=0)
+nonito_stub_server.point_app_at(STUB_SERVER)
+
+import main  # noqa: E402,F401
+
+# Outside `streamlit run` every st.* call warns about the missing script run context
+for logger_name in list(logging.root.manager.loggerDict):
+    if logger_name.startswith("streamlit"):
+        logging.getLogger(logger_name).setLevel(logging.ERROR)
+
+
+@pytest.fixture
+def stub():
+    """The stub server, with throttling switched off again after each test"""
+    yield STUB_SERVER
+    STUB_SERVER.throttle_remaining = 0
+    STUB_SERVER.retry_after = 1
+
+
+@pytest.fixture
+def make_generator():
+    """Build offline generators fed with the given cars"""
+    OfflineGenerator = nonito_stub_server._offline_generator_class()
+
+    def make(cars=(), **kwargs):
+        kwargs.setdefault("use_link_cache", False)
+        kwargs.setdefault("skip_posted", False)
+        kwargs.setdefault("use_outbox", False)
+        return OfflineGenerator(list(cars), **kwargs)
+
+    return make
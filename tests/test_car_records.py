@@ -0,0 +1,57 @@
+"""
+_cars_frame (pandas) and _cars_table (Arrow) map query results to the same car records
+"""
+import decimal
+from datetime import date
+
+import pyarrow as pa
+import pytest
+
+import main
+
+Generator = main.FlashSalePostGenerator
+
+
+def result_table(years, kilometrage=None, makes=None):
+    count = len(years)
+    return pa.table({
+        'sf_vehicle_name': [f"CAR{i}" for i in range(count)],
+        'ajans_vehicle_id': [str(1000 + i) for i in range(count)],
+        'car_make': makes if makes is not None else ["Toyota"] * count,
+        'car_model': ["Corolla"] * count,
+        'car_year': years,
+        'kilometrage': kilometrage if kilometrage is not None else years,
+        'published_at': [date(2024, 5, 1)] * count,
+    })
+
+
+def both_paths(result: pa.Table):
+    from_arrow = Generator._cars_table(result).to_pylist()
+    from_pandas = Generator._cars_frame(result.to_pandas()).to_dict('records')
+    return from_arrow, from_pandas
+
+
+@pytest.mark.parametrize("years", [
+    pa.array([2020, None, 2018]),
+    pa.array([2020.7, None, float('nan')]),
+    pa.array([decimal.Decimal("2020.00"), None]),
+    pa.array(["2020", " 2019 ", "abc", "", None, "2018.7", "1e3", "-5"]),
+    pa.array([None, None], pa.null()),
+], ids=["int", "float", "numeric", "string", "null"])
+def test_numeric_columns_match(years):
+    from_arrow, from_pandas = both_paths(result_table(years))
+    for field in ('year', 'kilometers'):
+        assert [record[field] for record in from_arrow] == [record[field] for record in from_pandas]
+
+
+def test_missing_make_and_model_become_unknown():
+    result = result_table(pa.array([2020, 2021]), makes=[None, "Kia"])
+    from_arrow, from_pandas = both_paths(result)
+    assert [record['make'] for record in from_arrow] == ["Unknown", "Kia"]
+    assert [record['make'] for record in from_pandas] == ["Unknown", "Kia"]
+
+
+def test_identity_fields_match():
+    from_arrow, from_pandas = both_paths(result_table(pa.array([2020, 2021])))
+    for field in ('sf_vehicle_name', 'ajans_vehicle_id', 'model'):
+        assert [record[field] for record in from_arrow] == [record[field] for record in from_pandas]
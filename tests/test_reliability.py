@@ -0,0 +1,165 @@
+"""
+CircuitBreaker, TokenBucket and how _apost_with_retry drives them
+"""
+import asyncio
+import time
+
+import httpx
+import pytest
+
+import main
+import nonito_stub_server
+
+
+def test_breaker_opens_after_threshold_and_rejects():
+    breaker = main.CircuitBreaker(failure_threshold=3, reset_timeout=60)
+    for _ in range(2):
+        breaker.record_failure()
+    assert breaker.state == "closed" and breaker.allow_request()
+
+    breaker.record_failure()
+    assert breaker.state == "open"
+    assert not breaker.allow_request()
+
+
+def test_breaker_success_resets_failure_count():
+    breaker = main.CircuitBreaker(failure_threshold=2, reset_timeout=60)
+    breaker.record_failure()
+    breaker.record_success()
+    breaker.record_failure()
+    assert breaker.state == "closed"
+
+
+def test_breaker_half_open_lets_one_trial_through():
+    breaker = main.CircuitBreaker(failure_threshold=1, reset_timeout=0.05)
+    breaker.record_failure()
+    assert not breaker.allow_request()
+
+    time.sleep(0.06)
+    assert breaker.allow_request()
+    assert breaker.state == "half_open"
+    assert not breaker.allow_request()
+
+    breaker.record_failure()
+    assert breaker.state == "open"
+
+    time.sleep(0.06)
+    assert breaker.allow_request()
+    breaker.record_success()
+    assert breaker.state == "closed" and breaker.allow_request()
+
+
+def test_bucket_allows_a_burst_then_paces():
+    async def run():
+        bucket = main.TokenBucket(rate=20, capacity=3)
+        started = time.monotonic()
+        for _ in range(3):
+            await bucket.acquire()
+        burst = time.monotonic() - started
+        await bucket.acquire()
+        return burst, time.monotonic() - started
+
+    burst, paced = asyncio.run(run())
+    assert burst < 0.02
+    assert paced >= 0.04
+
+
+def test_bucket_throttle_halves_rate_and_pauses_for_retry_after():
+    async def run():
+        bucket = main.TokenBucket(rate=100, capacity=10)
+        bucket.throttle(0.2)
+        started = time.monotonic()
+        await bucket.acquire()
+        return bucket, time.monotonic() - started
+
+    bucket, waited = asyncio.run(run())
+    assert bucket.rate == 50
+    assert waited >= 0.19
+
+
+def test_bucket_recovers_towards_max_rate():
+    bucket = main.TokenBucket(rate=10, capacity=10)
+    bucket.throttle()
+    assert bucket.rate == 5
+    for _ in range(100):
+        bucket.recover()
+    assert bucket.rate == 10
+
+
+def test_bucket_rate_never_drops_below_minimum():
+    bucket = main.TokenBucket(rate=1, capacity=1)
+    for _ in range(10):
+        bucket.throttle()
+    assert bucket.rate == main.RATE_LIMIT_MIN_RATE
+
+
+@pytest.fixture
+def fast_backoff(monkeypatch):
+    monkeypatch.setattr(main, "RETRY_BACKOFF_BASE", 0.01)
+    monkeypatch.setattr(main, "RETRY_BACKOFF_MAX", 0.02)
+
+
+def test_429_burst_does_not_open_the_breaker(stub, make_generator, fast_backoff):
+    generator = make_generator()
+    breaker = main.CircuitBreaker(failure_threshold=2)
+    stub.throttle_remaining = 5
+
+    response = generator._run(generator._apost_with_retry(
+        main.TRACKING_LINK_ENDPOINT, breaker=breaker, max_retries=5,
+        json={"link_name": "test", "final_link": "sylndr://car-details/1"}
+    ))
+
+    assert response.status_code == 200
+    assert breaker.state == "closed"
+    assert stub.counts["throttled"] >= 5
+
+
+def test_429_burst_still_yields_real_links(stub, make_generator, fast_backoff):
+    generator = make_generator(nonito_stub_server.synthetic_cars(40), link_concurrency=8, link_max_retries=10)
+    stub.throttle_remaining = 30
+
+    posts = generator.generate_posts()
+
+    assert len(posts) == 40
+    assert all(post['tracking_link'] != main.FALLBACK_TRACKING_LINK for post in posts)
+    assert generator.link_breaker.state == "closed"
+
+
+def test_429_pauses_the_limiter_for_the_full_retry_after(stub, make_generator, fast_backoff):
+    generator = make_generator(link_rate_limit=100)
+    stub.throttle_remaining = 1
+    stub.retry_after = 1
+
+    started = time.monotonic()
+    response = generator._run(generator._apost_with_retry(
+        main.TRACKING_LINK_ENDPOINT, max_retries=1,
+        json={"link_name": "test", "final_link": "sylndr://car-details/1"}
+    ))
+
+    # The retry sleep is capped at RETRY_BACKOFF_MAX, the limiter pause is not
+    assert response.status_code == 200
+    assert time.monotonic() - started >= 0.95
+    assert generator.link_limiter.rate < generator.link_limiter.max_rate
+
+
+def test_server_errors_open_the_breaker(make_generator, fast_backoff, monkeypatch):
+    generator = make_generator()
+    breaker = main.CircuitBreaker(failure_threshold=2)
+    client = httpx.AsyncClient(transport=httpx.MockTransport(lambda request: httpx.Response(503)))
+    monkeypatch.setattr(generator.http_runtime, "client", lambda url: client)
+
+    response = generator._run(generator._apost_with_retry(main.TRACKING_LINK_ENDPOINT, breaker=breaker,
+                                                          max_retries=1, json={}))
+    assert response.status_code == 503
+    assert breaker.state == "open"
+
+    with pytest.raises(main.CircuitOpenError):
+        generator._run(generator._apost_with_retry(main.TRACKING_LINK_ENDPOINT, breaker=breaker, json={}))
+
+
+def test_retry_after_header_forms():
+    parse = main.FlashSalePostGenerator._retry_after_seconds
+    assert parse("120") == 120.0
+    assert parse("") is None
+    assert parse("soon") is None
+    assert parse("Wed, 21 Oct 2015 07:28:00 GMT") == 0.0
@@ -0,0 +1,56 @@
+"""
+_next_watermark: the incremental mode watermark never moves past a car that wasn't posted
+"""
+from datetime import datetime, timezone
+
+import pandas as pd
+import pytest
+
+
+def car(hour, make="Toyota", published_ts=True):
+    return {
+        'sf_vehicle_name': f"CAR{hour}",
+        'ajans_vehicle_id': str(hour),
+        'make': make,
+        'model': "Corolla",
+        'published_ts': datetime(2024, 5, 1, hour, tzinfo=timezone.utc) if published_ts else None,
+    }
+
+
+POSTED = {'post': True}
+
+
+@pytest.fixture
+def generator(make_generator):
+    return make_generator()
+
+
+def test_all_posted_advances_to_latest(generator):
+    cars = [car(9), car(11), car(10)]
+    assert generator._next_watermark(cars, [POSTED] * 3) == cars[1]['published_ts']
+
+
+def test_failed_car_holds_watermark_below_it(generator):
+    cars = [car(9), car(10), car(11), car(12)]
+    results = [POSTED, POSTED, None, POSTED]
+    assert generator._next_watermark(cars, results) == cars[1]['published_ts']
+
+
+def test_cars_never_started_hold_the_watermark(generator):
+    cars = [car(9), car(10), car(8)]
+    # Only the first car's task finished before the run stopped
+    assert generator._next_watermark(cars, [POSTED]) is None
+
+
+def test_unpostable_cars_count_as_processed(generator):
+    cars = [car(9), car(10, make='Unknown')]
+    assert generator._next_watermark(cars, [POSTED, None]) == cars[1]['published_ts']
+
+
+def test_cars_without_published_ts_are_ignored(generator):
+    cars = [car(9), car(10, published_ts=False), {**car(11), 'published_ts': pd.NaT}]
+    assert generator._next_watermark(cars, [POSTED, None, None]) == cars[0]['published_ts']
+
+
+def test_no_cars_no_watermark(generator):
+    assert generator._next_watermark([], []) is None